@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+"""
+Multi-core composite scoring over feature arrays in shared memory
+
+share_features() copies the scoring arrays of a CompositeFeatures (genre
+masks, ratings, votes and the title/overview/actor CSR matrices) into
+multiprocessing.shared_memory blocks once. Worker processes attach to them
+without copying. ParallelScorer splits the candidate rows into one shard per
+worker; each worker returns its own top-k, and the parent merges the partial
+lists. Ties keep row order, so results equal single-process scoring.
+
+    python composite_parallel.py bench [replicate] [num_seeds]
+"""
+
+import atexit
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context, shared_memory
+import numpy as np
+from scipy import sparse
+from composite_features import CompositeFeatures
+
+# Worker processes for composite scoring; 0 keeps scoring in the request process
+COMPOSITE_WORKERS = int(os.getenv("COMPOSITE_WORKERS", "0"))
+# Fewer candidates than this are scored in-process; IPC would cost more than it saves
+PARALLEL_MIN_ROWS = int(os.getenv("COMPOSITE_PARALLEL_MIN_ROWS", "50000"))
+
+ARRAYS = ("genre_masks", "ratings", "votes")
+MATRICES = ("titlewords", "overview", "actors")
+
+# Features attached by a worker process (see attach_worker)
+_worker_features = None
+_worker_blocks = []
+
+
+def share_features(features):
+    """
+    Copy the scoring arrays of `features` into shared memory
+
+    Returns (descriptor, blocks): the picklable descriptor workers attach with,
+    and the SharedMemory blocks the caller must close and unlink.
+    """
+    blocks = []
+
+    def put(array):
+        array = np.ascontiguousarray(array)
+        block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+        np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[...] = array
+        blocks.append(block)
+        return {"name": block.name, "shape": array.shape, "dtype": array.dtype.str}
+
+    descriptor = {
+        "arrays": {name: put(getattr(features, name)) for name in ARRAYS},
+        "matrices": {},
+        "genre_bits": features.genre_bits,
+        "actor_columns": features.actor_columns,
+        "num_movies": len(features),
+    }
+    for name in MATRICES:
+        matrix = getattr(features, name)
+        descriptor["matrices"][name] = {
+            "shape": matrix.shape,
+            "parts": {part: put(getattr(matrix, part)) for part in ("data", "indices", "indptr")},
+        }
+    return descriptor, blocks
+
+
+def attach_features(descriptor):
+    """CompositeFeatures over the shared blocks of `descriptor` (no postings); returns (features, blocks)"""
+    blocks = []
+
+    def get(spec):
+        # Spawned workers share the parent's resource tracker, which unlinks the block once, on close()
+        block = shared_memory.SharedMemory(name=spec["name"])
+        blocks.append(block)
+        return np.ndarray(spec["shape"], dtype=np.dtype(spec["dtype"]), buffer=block.buf)
+
+    arrays = {name: get(spec) for name, spec in descriptor["arrays"].items()}
+    matrices = {
+        name: sparse.csr_matrix(
+            tuple(get(spec["parts"][part]) for part in ("data", "indices", "indptr")),
+            shape=spec["shape"], copy=False,
+        )
+        for name, spec in descriptor["matrices"].items()
+    }
+    features = CompositeFeatures(
+        np.arange(descriptor["num_movies"], dtype=np.int64), descriptor["genre_bits"],
+        arrays["genre_masks"], arrays["ratings"], arrays["votes"],
+        matrices["titlewords"], matrices["overview"], matrices["actors"],
+        descriptor["actor_columns"], postings=False,
+    )
+    return features, blocks
+
+
+def attach_worker(descriptor):
+    """Process-pool initializer"""
+    global _worker_features, _worker_blocks
+    _worker_features, _worker_blocks = attach_features(descriptor)
+
+
+def shard_top_k(features, seed, weights, rows, limit):
+    """Score `rows` against the seed; return this shard's best (rows, scores), best first"""
+    from composite_ranking_recommend import ranked_rows, weighted_score
+
+    scores = weighted_score(features.breakdown(rows=rows, **seed), weights)
+    best = ranked_rows(scores, limit)
+    return rows[best], scores[best]
+
+
+def score_shard(seed, weights, rows, limit):
+    return shard_top_k(_worker_features, seed, weights, rows, limit)
+
+
+def merge_top_k(partials, limit):
+    """Merge per-shard top-k lists (shards in row order) into the global top-k"""
+    from composite_ranking_recommend import ranked_rows
+
+    rows = np.concatenate([rows for rows, _ in partials])
+    scores = np.concatenate([scores for _, scores in partials])
+    best = ranked_rows(scores, limit)
+    return rows[best], scores[best]
+
+
+class ParallelScorer:
+    """Process pool whose workers score shards of the candidate rows from shared memory"""
+
+    def __init__(self, features, workers):
+        self.workers = workers
+        self.descriptor, self.blocks = share_features(features)
+        self.executor = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=get_context("spawn"),  # forking a threaded server process is not safe
+            initializer=attach_worker,
+            initargs=(self.descriptor,),
+        )
+
+    def top_k(self, seed, weights, rows, limit, exclude_row=None):
+        """Best `limit` of the candidate `rows` (ascending), best first: (rows, scores)"""
+        if exclude_row is not None:
+            rows = rows[rows != exclude_row]
+        shards = [shard for shard in np.array_split(rows, self.workers) if len(shard)]
+        futures = [self.executor.submit(score_shard, seed, weights, shard, limit) for shard in shards]
+        return merge_top_k([future.result() for future in futures], limit)
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        for block in self.blocks:
+            block.close()
+            block.unlink()
+        self.blocks = []
+
+
+# Process-wide scorer, replaced whenever the features are rebuilt
+_scorer = None
+
+
+def start_scorer(features, workers=COMPOSITE_WORKERS):
+    """Share `features` with a new worker pool, replacing the previous one; None if workers is 0"""
+    global _scorer
+    previous = _scorer
+    _scorer = ParallelScorer(features, workers) if workers > 0 else None
+    if previous is not None:
+        previous.close()
+    if _scorer is not None:
+        print(f"⚙️ Composite scoring on {workers} worker processes")
+    return _scorer
+
+
+def get_scorer():
+    return _scorer
+
+
+@atexit.register
+def stop_scorer():
+    global _scorer
+    if _scorer is not None:
+        _scorer.close()
+        _scorer = None
+
+
+def replicated(features, times):
+    """The catalog repeated `times` times, to benchmark at a larger scale"""
+    if times <= 1:
+        return features
+    return CompositeFeatures(
+        np.arange(len(features) * times, dtype=np.int64), features.genre_bits,
+        np.tile(features.genre_masks, times), np.tile(features.ratings, times), np.tile(features.votes, times),
+        sparse.vstack([features.titlewords] * times, format="csr"),
+        sparse.vstack([features.overview] * times, format="csr"),
+        sparse.vstack([features.actors] * times, format="csr"),
+        features.actor_columns, postings=False,
+    )
+
+
+def benchmark(replicate=1, num_seeds=20, limit=6, seed=0):
+    """Full-catalog scoring time per seed at 1, 2, 4, ... workers up to the core count"""
+    import composite_ranking_recommend as composite
+    import token_store
+    from database import get_db
+    from models import Movie
+    from sqlalchemy.orm import joinedload
+
+    with get_db() as db:
+        composite.initialize_features(db)
+        store = token_store.get_store(db)
+        rng = np.random.default_rng(seed)
+        seed_ids = rng.choice(composite.features.movie_ids, min(num_seeds, len(composite.features)), replace=False)
+        movies = db.query(Movie).options(joinedload(Movie.genres_rel)).filter(Movie.id.in_(seed_ids.tolist())).all()
+        seeds = [composite.seed_features(movie, store) for movie in movies]
+
+    features = replicated(composite.features, replicate)
+    rows = np.arange(len(features))
+    print(f"[INFO] {len(features)} movies, {len(seeds)} seeds, {os.cpu_count()} cores")
+
+    start = time.time()
+    expected = [shard_top_k(features, s, composite.WEIGHTS, rows, limit) for s in seeds]
+    baseline = (time.time() - start) / len(seeds)
+    print(f"[INFO] in-process: {baseline * 1000:.1f} ms/seed")
+
+    counts = sorted({1, 2, 4, 8, 16, os.cpu_count() or 1})
+    for workers in [n for n in counts if n <= (os.cpu_count() or 1)]:
+        scorer = ParallelScorer(features, workers)
+        try:
+            scorer.top_k(seeds[0], composite.WEIGHTS, rows, limit)  # spawn and attach the workers
+            start = time.time()
+            results = [scorer.top_k(s, composite.WEIGHTS, rows, limit) for s in seeds]
+            elapsed = (time.time() - start) / len(seeds)
+        finally:
+            scorer.close()
+        same = all(np.array_equal(a[0], b[0]) for a, b in zip(results, expected))
+        print(f"[INFO] {workers} workers: {elapsed * 1000:.1f} ms/seed, "
+              f"speedup {baseline / elapsed:.2f}x, {'same' if same else 'DIFFERENT'} results")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "bench":
+        benchmark(int(sys.argv[2]) if len(sys.argv) > 2 else 1, int(sys.argv[3]) if len(sys.argv) > 3 else 20)
+    else:
+        print("Usage: python composite_parallel.py bench [replicate] [num_seeds]")
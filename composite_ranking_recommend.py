@@ -1,21 +1,153 @@
 from sqlalchemy.orm import joinedload
 from models import Movie
-from gensim.utils import simple_preprocess
-from collections import defaultdict
+from database import get_db, movie_table_fingerprint, movie_votes_fingerprint, movie_genres_fingerprint
+from composite_features import build_features
+import composite_parallel
+import token_store
 import numpy as np
-
-def preprocess(text):
-    return simple_preprocess(text, deacc=True) if text else []
+import os
+import sys
+import threading
+import time
+
+# Stage 1 keeps at most this many candidates for full scoring (0 = score the whole catalog)
+COMPOSITE_POOL_SIZE = int(os.getenv("COMPOSITE_POOL_SIZE", "2000"))
+# Postings stage 1 may read; rare overview tokens are used first, common ones dropped past this
+COMPOSITE_POSTINGS_BUDGET = int(os.getenv("COMPOSITE_POSTINGS_BUDGET", "100000"))
+# How often recommend checks whether the movies table changed since the features were built
+COMPOSITE_REFRESH_SECONDS = float(os.getenv("COMPOSITE_REFRESH_SECONDS", "30"))
+
+WEIGHTS = {
+    "genre_overlap": 2,
+    "actor_overlap": 3,
+    "rating_score": 2,
+    "votes_score": 1.5,
+    "overview_overlap": 1,
+    "titleword_overlap": 1.5,
+}
 
 def parse_set(attr_val):
     if isinstance(attr_val, str):
         return set(s.strip().lower() for s in attr_val.split(","))
     elif isinstance(attr_val, list):
-        return set(str(s).strip().lower() for s in attr_val)
+        # Relationship lists hold ORM objects (e.g. Actor); compare them by name
+        return set(str(getattr(s, "name", s)).strip().lower() for s in attr_val)
     else:
         return set()
 
-def recommend(movie_id, limit, db):
+# Columnar features of every movie, built on first use (or by the startup warm-up)
+# and rebuilt when features_fingerprint changes
+features = None
+_features_lock = threading.Lock()
+
+
+def features_fingerprint(db):
+    return movie_table_fingerprint(db) + movie_votes_fingerprint(db) + movie_genres_fingerprint(db)
+
+
+def initialize_features(db, fingerprint=None):
+    global features
+    fingerprint = fingerprint or features_fingerprint(db)
+    built = build_features(db, token_store.get_store(db, movie_table_fingerprint(db)))
+    built.fingerprint, built.checked_at = fingerprint, time.time()
+    features = built
+    if composite_parallel.COMPOSITE_WORKERS > 0:
+        composite_parallel.start_scorer(features)
+
+
+def get_features(db):
+    """Return the features, rebuilding them (and the worker scorer) if the movies table changed"""
+    with _features_lock:
+        if features is not None and time.time() - features.checked_at < COMPOSITE_REFRESH_SECONDS:
+            return features
+        fingerprint = features_fingerprint(db)
+        if features is not None and features.fingerprint == fingerprint:
+            features.checked_at = time.time()
+        else:
+            initialize_features(db, fingerprint)
+        return features
+
+
+def ranked_rows(scores, limit, exclude=None):
+    """Rows of the `limit` best scores, best first; ties keep movie-id order like a stable sort"""
+    if exclude is not None:
+        scores[exclude] = -np.inf
+    limit = min(limit, len(scores) - (exclude is not None))
+    if limit <= 0:
+        return np.empty(0, dtype=np.int64)
+    threshold = np.partition(scores, len(scores) - limit)[len(scores) - limit]
+    rows = np.flatnonzero(scores >= threshold)
+    return rows[np.argsort(-scores[rows], kind="stable")][:limit]
+
+
+def weighted_score(details, weights):
+    return (
+        details["genre_overlap"] * weights["genre_overlap"] +
+        details["actor_overlap"] * weights["actor_overlap"] +
+        details["rating_score"] * weights["rating_score"] +
+        details["votes_score"] * weights["votes_score"] +
+        details["overview_overlap"] * weights["overview_overlap"] +
+        details["titleword_overlap"] * weights["titleword_overlap"]
+    )
+
+
+def score_candidates(seed, limit, exclude_row, pool_size, postings_budget, stats):
+    """
+    Two-stage ranking: candidate pool from the inverted indexes, full weighted score on the pool
+
+    Returns (rows, scores, details) for the best `limit` movies, best first.
+    With pool_size 0, or when stage 1 finds fewer than `limit` candidates,
+    every movie is scored. Large pools go to the worker
+    processes when COMPOSITE_WORKERS is set.
+    """
+    start = time.time()
+    pool, scanned, exclude = None, 0, None
+    if pool_size:
+        pool, scanned = features.candidates(
+            WEIGHTS, seed["genres"], seed["actor_names"], seed["title_ids"], seed["overview_ids"],
+            pool_size, postings_budget, exclude_row=exclude_row,
+        )
+    if pool is None or len(pool) < limit:
+        # Too few movies share anything with the seed: top up from the full
+        # ranking (rating and votes still score), so `limit` movies come back
+        pool, exclude = np.arange(len(features)), exclude_row
+    candidates_done = time.time()
+    pool_rows = len(pool)  # candidates scored; `pool` becomes the top-k rows in the parallel branch
+
+    scorer = composite_parallel.get_scorer()
+    if scorer is not None and len(pool) >= composite_parallel.PARALLEL_MIN_ROWS:
+        rows, scores = scorer.top_k(seed, WEIGHTS, pool, limit, exclude_row=exclude)
+        details = features.breakdown(rows=rows, **seed)
+        pool, best = rows, np.arange(len(rows))
+    else:
+        details = features.breakdown(rows=pool, **seed)
+        scores = weighted_score(details, WEIGHTS)
+        best = ranked_rows(scores, limit, exclude=exclude)
+    scoring_done = time.time()
+
+    stats.update({
+        "pool": pool_rows,
+        "postings_scanned": scanned,
+        "candidates_ms": round((candidates_done - start) * 1000, 2),
+        "scoring_ms": round((scoring_done - candidates_done) * 1000, 2),
+    })
+    return pool[best], scores[best], {name: values[best] for name, values in details.items()}
+
+
+def seed_features(movie, store):
+    """The seed movie's signals, in the form CompositeFeatures takes them"""
+    # Use genres_rel relationship instead of empty genres column
+    return {
+        "genres": set(genre.name.lower() for genre in movie.genres_rel) if movie.genres_rel else set(),
+        "actor_names": parse_set(movie.actors),
+        "rating": movie.vote_average or 0.0,
+        "votes": movie.vote_count or 0,
+        "title_ids": store.movie_title_ids(movie.id, movie.titlewords),
+        "overview_ids": store.movie_overview_ids(movie.id, movie.overview),
+    }
+
+
+def recommend(movie_id, limit, db, pool_size=None, stats=None):
     print("\n>>> COMPOSITE RANKINGS FUNCTION CALLED <<<")
 
     base_movie = (
@@ -31,64 +163,40 @@ def recommend(movie_id, limit, db):
 
     print(f"[COMPOSITE] Selected Movie: {base_movie.title}\n")
 
-    # Use genres_rel relationship instead of empty genres column
-    base_genres = set(genre.name.lower() for genre in base_movie.genres_rel) if base_movie.genres_rel else set()
-    base_actors = parse_set(base_movie.actors)
-    base_rating = base_movie.vote_average or 0.0
-    base_votes = base_movie.vote_count or 0
-    base_titlewords = parse_set(base_movie.titlewords)
-    base_overview_tokens = set(preprocess(base_movie.overview))
-
-    candidates = (
+    get_features(db)
+
+    stats = {} if stats is None else stats
+    seed = seed_features(base_movie, token_store.get_store(db))
+    rows, scores, details = score_candidates(
+        seed, limit, features.row_of(movie_id),
+        COMPOSITE_POOL_SIZE if pool_size is None else pool_size, COMPOSITE_POSTINGS_BUDGET, stats,
+    )
+    recommended_ids = features.movie_ids[rows].tolist()
+
+    fetch_start = time.time()
+    movies = (
         db.query(Movie)
-        .options(joinedload(Movie.genres_rel))  # Load genres to avoid N+1 queries
-        .filter(Movie.id != movie_id)
-        .limit(45000)
+        .options(joinedload(Movie.genres_rel))
+        .filter(Movie.id.in_(recommended_ids))
         .all()
     )
-
-    scored_candidates = []
-
-    for candidate in candidates:
-        # Use genres_rel relationship instead of empty genres column
-        cand_genres = set(genre.name.lower() for genre in candidate.genres_rel) if candidate.genres_rel else set()
-        cand_actors = parse_set(candidate.actors)
-        cand_rating = candidate.vote_average or 0.0
-        cand_votes = candidate.vote_count or 0
-        cand_titlewords = parse_set(candidate.titlewords)
-        cand_overview_tokens = set(preprocess(candidate.overview))
-
-        genre_score = len(base_genres & cand_genres)
-        actor_score = len(base_actors & cand_actors)
-        rating_diff = abs(base_rating - cand_rating)
-        votes_diff = abs(base_votes - cand_votes)
-
-        rating_score = 1 / (1 + rating_diff)
-        votes_score = 1 / (1 + (votes_diff / 1000))
-
-        overview_overlap = len(base_overview_tokens & cand_overview_tokens)
-        titleword_overlap = len(base_titlewords & cand_titlewords)
-
-        score = (
-            genre_score * 2 +
-            actor_score * 3 +
-            rating_score * 2 +
-            votes_score * 1.5 +
-            overview_overlap * 1 +
-            titleword_overlap * 1.5
-        )
-
-        scored_candidates.append((candidate, score, {
-            "genre_overlap": genre_score,
-            "actor_overlap": actor_score,
-            "rating_score": round(rating_score, 2),
-            "votes_score": round(votes_score, 2),
-            "overview_overlap": overview_overlap,
-            "titleword_overlap": titleword_overlap
-        }))
-
-    scored_candidates.sort(key=lambda x: x[1], reverse=True)
-    top_recommendations = scored_candidates[:limit]
+    id_to_movie = {movie.id: movie for movie in movies}
+    stats["fetch_ms"] = round((time.time() - fetch_start) * 1000, 2)
+    print(f"[COMPOSITE] Candidates: {stats['pool']} of {len(features)} movies "
+          f"({stats['postings_scanned']} postings) in {stats['candidates_ms']} ms, "
+          f"scoring {stats['scoring_ms']} ms, fetch {stats['fetch_ms']} ms")
+
+    top_recommendations = []
+    for i, rid in enumerate(recommended_ids):
+        if rid in id_to_movie:
+            top_recommendations.append((id_to_movie[rid], scores[i], {
+                "genre_overlap": int(details["genre_overlap"][i]),
+                "actor_overlap": int(details["actor_overlap"][i]),
+                "rating_score": round(float(details["rating_score"][i]), 2),
+                "votes_score": round(float(details["votes_score"][i]), 2),
+                "overview_overlap": int(details["overview_overlap"][i]),
+                "titleword_overlap": int(details["titleword_overlap"][i])
+            }))
 
     print(">>> Top Recommendations:\n")
     for movie, score, details in top_recommendations:
@@ -101,3 +209,37 @@ def recommend(movie_id, limit, db):
         print(f"  • Titleword overlap: {details['titleword_overlap']}\n")
 
     return [movie for movie, _, _ in top_recommendations]
+
+
+def benchmark(num_seeds=50, limit=6, seed=0):
+    """Compare pooled ranking against scoring the whole catalog: timings and top-k agreement"""
+    with get_db() as db:
+        if features is None:
+            initialize_features(db)
+        store = token_store.get_store(db)
+        rng = np.random.default_rng(seed)
+        seed_ids = rng.choice(features.movie_ids, min(num_seeds, len(features)), replace=False).tolist()
+        movies = db.query(Movie).options(joinedload(Movie.genres_rel)).filter(Movie.id.in_(seed_ids)).all()
+        seeds = [(features.row_of(m.id), seed_features(m, store)) for m in movies]
+
+    for pool_size in (0, COMPOSITE_POOL_SIZE):
+        totals = {"pool": 0, "candidates_ms": 0.0, "scoring_ms": 0.0}
+        agreement = 0
+        for row, seed_movie in seeds:
+            stats = {}
+            rows, _, _ = score_candidates(seed_movie, limit, row, pool_size, COMPOSITE_POSTINGS_BUDGET, stats)
+            full, _, _ = score_candidates(seed_movie, limit, row, 0, COMPOSITE_POSTINGS_BUDGET, {})
+            agreement += len(set(rows.tolist()) & set(full.tolist()))
+            for key in totals:
+                totals[key] += stats[key]
+        n = len(seeds)
+        print(f"[INFO] pool_size={pool_size or 'all'}: avg pool {totals['pool'] / n:.0f}, "
+              f"candidates {totals['candidates_ms'] / n:.2f} ms, scoring {totals['scoring_ms'] / n:.2f} ms, "
+              f"top-{limit} agreement with full scoring {agreement / (n * limit):.1%}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "bench":
+        benchmark(int(sys.argv[2]) if len(sys.argv) > 2 else 50)
+    else:
+        print("Usage: python composite_ranking_recommend.py bench [num_seeds]")
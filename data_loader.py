@@ -1,13 +1,15 @@
 import os
 import pandas as pd
 from typing import Dict, Optional
+from sqlalchemy import text
 from sqlalchemy.orm import Session
-from models import Movie, Genre, Actor, Rating
+from models import Movie, Genre, Actor, Rating, movie_genre_genre_movie_index
 import ast
 import json
 import re
 import csv
-from database import get_db, init_db
+from database import get_db, init_db, engine, ensure_change_tracking
+from movie_fts import build_fts
 
 class DataLoader:
     def __init__(self, data_dir: str = "ml-latest-small"):
@@ -171,6 +173,45 @@ class DataLoader:
         db.commit()
         print(f"Imported {len(movies_df)} movies with TMDB IDs, genres, and title words (and IMDB IDs)")
 
+    def normalize_genres(self, db: Session) -> None:
+        """Populate genres and movie_genre from the comma-joined Movie.genres strings, in bulk"""
+        # New links then bump the "genres" counter, so running servers rebuild their genre indexes
+        ensure_change_tracking(db)
+        movies_df = pd.DataFrame(db.query(Movie.id, Movie.genres).all(), columns=["movie_id", "genres"])
+        pairs = (
+            movies_df.dropna(subset=["genres"])
+            .assign(name=lambda df: df["genres"].str.split(r"[,|]"))
+            .explode("name")
+            .assign(name=lambda df: df["name"].str.strip())
+        )
+        pairs = pairs[pairs["name"] != ""][["movie_id", "name"]].drop_duplicates()
+        print(f"Found {pairs['name'].nunique()} distinct genres in {pairs['movie_id'].nunique()} movies")
+
+        # New Genre rows in one executemany
+        existing = pd.DataFrame(db.query(Genre.id, Genre.name).all(), columns=["genre_id", "name"])
+        new_names = sorted(set(pairs["name"]) - set(existing["name"]))
+        if new_names:
+            db.execute(text("INSERT INTO genres (name) VALUES (:name)"), [{"name": n} for n in new_names])
+            existing = pd.DataFrame(db.query(Genre.id, Genre.name).all(), columns=["genre_id", "name"])
+        print(f"Inserted {len(new_names)} new genres")
+
+        # movie_genre pairs that are not linked yet, also in one executemany
+        pairs = pairs.merge(existing, on="name")[["movie_id", "genre_id"]]
+        linked = pd.DataFrame(
+            db.execute(text("SELECT movie_id, genre_id FROM movie_genre")).all(), columns=["movie_id", "genre_id"]
+        )
+        missing = pairs.merge(linked, on=["movie_id", "genre_id"], how="left", indicator=True)
+        missing = missing[missing["_merge"] == "left_only"]
+        if len(missing):
+            db.execute(
+                text("INSERT INTO movie_genre (movie_id, genre_id) VALUES (:movie_id, :genre_id)"),
+                [{"movie_id": int(m), "genre_id": int(g)} for m, g in zip(missing["movie_id"], missing["genre_id"])],
+            )
+        db.commit()
+        print(f"Linked {len(missing)} movie-genre pairs")
+
+        movie_genre_genre_movie_index.create(bind=engine, checkfirst=True)
+
     def import_credits(self, db: Session, credits_df: pd.DataFrame) -> None:
         """Import credits (actors) into database"""
         print(f"Starting import_credits with {len(credits_df)} rows")
@@ -292,6 +333,14 @@ class DataLoader:
             print("Loading movies...")
             movies_df = self.load_movies()
             self.import_movies(db, movies_df)
+
+            # Normalize genres into genres / movie_genre
+            print("Normalizing genres...")
+            self.normalize_genres(db)
+
+            # Full-text index over titles and overviews; triggers keep it in sync afterwards
+            print("Building full-text index...")
+            build_fts(db)
             
             # Load credits
             print("Loading credits...")
@@ -324,6 +373,11 @@ def init_database():
         loader = DataLoader()
         loader.load_all_data(db)
 
+def normalize_existing_genres():
+    """Backfill genres and movie_genre from Movie.genres for an existing database"""
+    with get_db() as db:
+        DataLoader().normalize_genres(db)
+
 def update_existing_movies():
     """Update title words for existing movies in the database"""
     with get_db() as db:
@@ -336,6 +390,9 @@ if __name__ == "__main__":
     if len(sys.argv) > 1 and sys.argv[1] == "update":
         print("🔄 Updating title words for existing movies...")
         update_existing_movies()
+    elif len(sys.argv) > 1 and sys.argv[1] == "genres":
+        print("🔄 Normalizing genres for existing movies...")
+        normalize_existing_genres()
     else:
         print("🚀 Initializing database and loading all data...")
         init_database() 
\ No newline at end of file
@@ -3,13 +3,14 @@
 Script to generate OpenAI embeddings for movies based on title, release_date, and overview
 """
 
-import json
 import os
 import time
 import requests
 from datetime import datetime, timedelta
 from database import get_db
 from models import Movie
+from embedding_codec import encode_embedding
+import embedding_segments
 from dotenv import load_dotenv
 
 # Load environment variables
@@ -177,11 +178,14 @@ def generate_embeddings_for_movies():
             if embeddings and len(embeddings) == len(batch_movies):
                 # Save embeddings to database
                 for movie, embedding in zip(batch_movies, embeddings):
-                    movie.embedding_vector = json.dumps(embedding)
+                    movie.embedding_vector = encode_embedding(embedding)
                     processed_count += 1
                 
                 # Commit the batch
                 db.commit()
+
+                # Publish the batch as a delta segment so running servers can recommend it
+                embedding_segments.write_segment([movie.id for movie in batch_movies], embeddings)
                 
                 # Calculate progress and time estimates
                 batch_time = time.time() - batch_start_time
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Convert Movie.embedding_vector from JSON text to the binary float32 format, in streaming batches.
+
+Only rows still stored as text are touched, so the migration can be interrupted and re-run.
+
+    python data_processing/migrate_embedding_blobs.py [batch_size] [--vacuum]
+    python data_processing/migrate_embedding_blobs.py benchmark [rows]
+"""
+import os
+import sys
+sys.path.append(os.path.dirname(os.path.abspath(__file__)) + '/..')
+import time
+from sqlalchemy import func, text
+from models import Movie
+from database import get_db, engine
+from embedding_codec import encode_embedding, decode_embedding
+
+
+def database_size_mb():
+    if engine.url.get_backend_name() != "sqlite" or not engine.url.database:
+        return None
+    path = engine.url.database
+    return os.path.getsize(path) / 1e6 if os.path.exists(path) else None
+
+
+def count_by_storage(db):
+    rows = (
+        db.query(func.typeof(Movie.embedding_vector), func.count(), func.sum(func.length(Movie.embedding_vector)))
+        .filter(Movie.embedding_vector.isnot(None))
+        .group_by(func.typeof(Movie.embedding_vector))
+        .all()
+    )
+    return {kind: (count, int(size or 0)) for kind, count, size in rows}
+
+
+def migrate_embeddings(batch_size=500, vacuum=False):
+    start = time.time()
+    size_before = database_size_mb()
+
+    with get_db() as db:
+        before = count_by_storage(db)
+    pending = before.get("text", (0, 0))[0]
+    print(f"📊 Embeddings by storage type: {before}")
+    print(f"🔄 Converting {pending} JSON embeddings in batches of {batch_size}...")
+
+    converted = failed = 0
+    last_id = -1
+    while True:
+        with get_db() as db:
+            rows = (
+                db.query(Movie.id, Movie.embedding_vector)
+                .filter(Movie.id > last_id, func.typeof(Movie.embedding_vector) == "text")
+                .order_by(Movie.id)
+                .limit(batch_size)
+                .all()
+            )
+            if not rows:
+                break
+            last_id = rows[-1].id
+
+            updates = []
+            for movie_id, raw_vector in rows:
+                try:
+                    updates.append({"movie_id": movie_id, "blob": encode_embedding(decode_embedding(raw_vector))})
+                except (ValueError, TypeError) as e:
+                    print(f"⚠️ Could not convert embedding of movie {movie_id}: {e}")
+                    failed += 1
+            if updates:
+                # One executemany per batch instead of an ORM flush per row
+                db.execute(text("UPDATE movies SET embedding_vector = :blob WHERE id = :movie_id"), updates)
+            converted += len(updates)
+        print(f"✅ {converted}/{pending} converted ({failed} failed)")
+
+    if vacuum and engine.url.get_backend_name() == "sqlite":
+        print("🔄 VACUUM to reclaim freed pages...")
+        with engine.connect() as conn:
+            conn.execution_options(isolation_level="AUTOCOMMIT").execute(text("VACUUM"))
+
+    with get_db() as db:
+        after = count_by_storage(db)
+    print(f"📊 Embeddings by storage type: {after}")
+    text_bytes = before.get("text", (0, 0))[1]
+    if text_bytes:
+        blob_bytes = after.get("blob", (0, 0))[1] - before.get("blob", (0, 0))[1]
+        print(f"📉 Converted embeddings: {text_bytes / 1e6:.1f} MB of JSON -> {blob_bytes / 1e6:.1f} MB binary")
+    size_after = database_size_mb()
+    if size_before is not None and size_after is not None:
+        print(f"💾 Database file: {size_before:.1f} MB -> {size_after:.1f} MB"
+              f"{'' if vacuum else ' (run with --vacuum to shrink the file)'}")
+    print(f"⏱️ Migration took {time.time() - start:.1f}s")
+
+
+def benchmark_fetch(limit=5000):
+    """Time fetching and decoding embeddings, split by storage type"""
+    with get_db() as db:
+        for kind in ("text", "blob"):
+            start = time.time()
+            rows = (
+                db.query(Movie.id, Movie.embedding_vector)
+                .filter(func.typeof(Movie.embedding_vector) == kind)
+                .limit(limit)
+                .all()
+            )
+            fetched = time.time()
+            for _, raw_vector in rows:
+                decode_embedding(raw_vector)
+            decoded = time.time()
+            if rows:
+                print(f"⏱️ {kind:>4}: {len(rows)} rows fetched in {fetched - start:.3f}s, "
+                      f"decoded in {decoded - fetched:.3f}s")
+            else:
+                print(f"⏱️ {kind:>4}: no rows")
+
+
+if __name__ == "__main__":
+    args = [a for a in sys.argv[1:] if not a.startswith("--")]
+    if args and args[0] == "benchmark":
+        benchmark_fetch(int(args[1]) if len(args) > 1 else 5000)
+    else:
+        migrate_embeddings(int(args[0]) if args else 500, vacuum="--vacuum" in sys.argv)
@@ -1,7 +1,8 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, text
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
 from contextlib import contextmanager
+import hashlib
 import os
 
 # Get the database URL from environment variable or use default
@@ -26,7 +27,104 @@ def get_db():
     finally:
         db.close()
 
+# Change counters for the movies table, bumped by triggers on SQLite. "content" counts
+# inserts, deletes and edits of the text columns derived indexes are built from;
+# "votes" counts inserts, deletes and vote_average / vote_count edits; "genres" counts
+# movie_genre links added or removed (e.g. by `python data_loader.py genres`).
+# The random epoch tells a recreated database apart from the one artifacts were built on.
+MOVIE_VERSION_DDL = [
+    "CREATE TABLE IF NOT EXISTS movie_table_version "
+    "(name TEXT PRIMARY KEY, epoch TEXT NOT NULL, version INTEGER NOT NULL)",
+    "INSERT OR IGNORE INTO movie_table_version (name, epoch, version) VALUES "
+    "('content', lower(hex(randomblob(8))), 0), ('votes', lower(hex(randomblob(8))), 0), "
+    "('genres', lower(hex(randomblob(8))), 0)",
+    "CREATE TRIGGER IF NOT EXISTS movies_version_ai AFTER INSERT ON movies BEGIN "
+    "UPDATE movie_table_version SET version = version + 1; END",
+    "CREATE TRIGGER IF NOT EXISTS movies_version_ad AFTER DELETE ON movies BEGIN "
+    "UPDATE movie_table_version SET version = version + 1; END",
+    "CREATE TRIGGER IF NOT EXISTS movies_version_au AFTER UPDATE OF id, title, overview, titlewords ON movies BEGIN "
+    "UPDATE movie_table_version SET version = version + 1 WHERE name = 'content'; END",
+    "CREATE TRIGGER IF NOT EXISTS movies_votes_version_au AFTER UPDATE OF id, vote_average, vote_count ON movies BEGIN "
+    "UPDATE movie_table_version SET version = version + 1 WHERE name = 'votes'; END",
+    "CREATE TRIGGER IF NOT EXISTS movie_genre_version_ai AFTER INSERT ON movie_genre BEGIN "
+    "UPDATE movie_table_version SET version = version + 1 WHERE name = 'genres'; END",
+    "CREATE TRIGGER IF NOT EXISTS movie_genre_version_ad AFTER DELETE ON movie_genre BEGIN "
+    "UPDATE movie_table_version SET version = version + 1 WHERE name = 'genres'; END",
+]
+
+# Set once the counters and triggers are known to exist in this process
+_change_tracking = False
+
 def init_db():
     """Initialize the database, creating all tables."""
     from models import Base
-    Base.metadata.create_all(bind=engine) 
\ No newline at end of file
+    Base.metadata.create_all(bind=engine)
+    with get_db() as db:
+        ensure_change_tracking(db)
+
+def ensure_change_tracking(db):
+    """Create the movie_table_version counters and their triggers if missing (SQLite only)"""
+    global _change_tracking
+    if _change_tracking or engine.dialect.name != "sqlite":
+        return _change_tracking
+    for statement in MOVIE_VERSION_DDL:
+        db.execute(text(statement))
+    db.commit()
+    _change_tracking = True
+    return True
+
+def movie_table_version(db, name):
+    """(epoch, version) of a movie_table_version counter, or None without change tracking"""
+    if not ensure_change_tracking(db):
+        return None
+    return tuple(db.execute(
+        text("SELECT epoch, version FROM movie_table_version WHERE name = :name"), {"name": name}
+    ).one())
+
+def movie_table_fingerprint(db):
+    """
+    Fingerprint of the movies table, used to key derived indexes and caches.
+
+    Changes whenever movies are added or removed, or a title, overview or
+    titlewords value is edited (same-length edits included), via the
+    trigger-maintained "content" counter, a one-row read. Without change
+    tracking (non-SQLite) it falls back to full-table aggregates, which miss
+    same-length edits.
+    """
+    version = movie_table_version(db, "content")
+    if version is None:
+        version = tuple(db.execute(text(
+            "SELECT COUNT(*), COALESCE(MAX(id), 0), "
+            "COALESCE(SUM(LENGTH(title)), 0), COALESCE(SUM(LENGTH(overview)), 0), "
+            "COALESCE(SUM(id % 1000003 * LENGTH(overview)), 0) FROM movies"
+        )).one())
+    return hashlib.sha1(repr(version).encode()).hexdigest()[:16]
+
+def movie_votes_fingerprint(db):
+    """
+    Fingerprint of the vote_average / vote_count columns, for indexes that filter or rank by votes
+
+    movie_table_fingerprint ignores votes. This one follows the "votes"
+    counter, or falls back to vote sums without change tracking.
+    """
+    version = movie_table_version(db, "votes")
+    if version is None:
+        version = tuple(db.execute(text(
+            "SELECT COUNT(*), COALESCE(SUM(vote_count), 0), COALESCE(SUM(vote_average), 0), "
+            "COALESCE(SUM(id % 1000003 * COALESCE(vote_count, 0)), 0) FROM movies"
+        )).one())
+    return hashlib.sha1(repr(version).encode()).hexdigest()[:16]
+
+def movie_genres_fingerprint(db):
+    """
+    Fingerprint of the movie_genre links, for indexes built from movie genres
+
+    Follows the "genres" counter, or falls back to link aggregates without
+    change tracking.
+    """
+    version = movie_table_version(db, "genres")
+    if version is None:
+        version = tuple(db.execute(text(
+            "SELECT COUNT(*), COALESCE(SUM(movie_id % 1000003 * genre_id), 0) FROM movie_genre"
+        )).one())
+    return hashlib.sha1(repr(version).encode()).hexdigest()[:16]
@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+"""
+Approximate nearest-neighbour search over the embedding store (inverted-file index)
+
+Rows of the store are clustered with spherical k-means. A query scores the
+centroids, then only the rows in the `nprobe` closest clusters. Larger
+`nprobe` means higher recall and higher latency; nprobe == nlist is exact.
+
+    python embedding_ann.py build [nlist]
+    python embedding_ann.py recall [k] [nprobe ...]
+"""
+
+import os
+import time
+import numpy as np
+import embedding_store
+
+EMBEDDING_SEARCH_MODE = os.getenv("EMBEDDING_SEARCH_MODE", "exact")  # "exact" or "ivf"
+IVF_NPROBE = int(os.getenv("EMBEDDING_IVF_NPROBE", "8"))
+IVF_FILE = "ivf_index.npz"
+
+# Loaded index, shared by every request in this process
+_index = None
+
+
+class IVFIndex:
+    """Cluster centroids plus the store rows of every cluster, stored CSR-style"""
+
+    def __init__(self, centroids, list_offsets, list_rows):
+        self.centroids = centroids        # (nlist, dim) float32, unit rows
+        self.list_offsets = list_offsets  # (nlist + 1,) int64
+        self.list_rows = list_rows        # store rows grouped by cluster, ascending inside each
+
+    @property
+    def nlist(self):
+        return len(self.centroids)
+
+    def candidate_rows(self, query, nprobe):
+        """Return the store rows of the nprobe clusters closest to the query"""
+        nprobe = max(1, min(nprobe, self.nlist))
+        probe = embedding_store.top_k_indices(self.centroids @ query, nprobe)
+        return np.concatenate([
+            self.list_rows[self.list_offsets[c]:self.list_offsets[c + 1]] for c in probe
+        ])
+
+    def search(self, matrix, query, k, nprobe=IVF_NPROBE, exclude_row=None):
+        """Return (rows, similarities) of the approximate top k, best first; `exclude_row` is a row or rows"""
+        rows = self.candidate_rows(query, nprobe)
+        if exclude_row is not None:
+            rows = rows[~np.isin(rows, exclude_row)]
+        if len(rows) == 0:
+            return rows, np.empty(0, dtype=np.float32)
+        rows.sort()  # sequential access into the memmap
+        scores = matrix[rows] @ query
+        best = embedding_store.top_k_indices(scores, k)
+        return rows[best], scores[best]
+
+
+def spherical_kmeans(vectors, nlist, iterations=10, seed=0, block_size=4096):
+    """Cluster unit vectors by cosine similarity; returns unit-norm centroids"""
+    rng = np.random.default_rng(seed)
+    centroids = np.array(vectors[rng.choice(len(vectors), nlist, replace=False)], dtype=np.float32)
+
+    for iteration in range(iterations):
+        assignments = assign_clusters(vectors, centroids, block_size)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, vectors)
+        counts = np.bincount(assignments, minlength=nlist)
+
+        # Re-seed empty clusters from random points so every list gets used
+        empty = np.flatnonzero(counts == 0)
+        if len(empty):
+            sums[empty] = vectors[rng.choice(len(vectors), len(empty), replace=False)]
+
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        centroids = sums / norms
+    return centroids.astype(np.float32)
+
+
+def assign_clusters(vectors, centroids, block_size=4096):
+    """Return the index of the closest centroid for every vector, block by block"""
+    assignments = np.empty(len(vectors), dtype=np.int64)
+    for start in range(0, len(vectors), block_size):
+        block = np.asarray(vectors[start:start + block_size], dtype=np.float32)
+        assignments[start:start + block_size] = np.argmax(block @ centroids.T, axis=1)
+    return assignments
+
+
+def build_index(store, nlist=None, train_size=None, directory=embedding_store.EMBEDDING_STORE_DIR):
+    """Train centroids on a sample of the store, assign every row and save the index"""
+    start = time.time()
+    n = len(store)
+    if nlist is None:
+        nlist = max(1, int(4 * np.sqrt(n)))
+    nlist = min(nlist, n)
+    if train_size is None:
+        train_size = min(n, 64 * nlist)
+
+    print(f"🔄 Training {nlist} clusters on {train_size} of {n} embeddings...")
+    rng = np.random.default_rng(0)
+    sample_rows = np.sort(rng.choice(n, train_size, replace=False))
+    centroids = spherical_kmeans(np.asarray(store.matrix[sample_rows]), nlist)
+
+    print("🔄 Assigning all embeddings to clusters...")
+    index = index_from_centroids(centroids, store.matrix)
+    path = save_index(index, store.version, directory)
+    sizes = np.diff(index.list_offsets)
+    print(f"✅ IVF index saved to {path} in {time.time() - start:.1f}s "
+          f"(list sizes: min {sizes.min()}, median {int(np.median(sizes))}, max {sizes.max()})")
+    return index
+
+
+def index_from_centroids(centroids, matrix):
+    """Assign every matrix row to its closest centroid; reused after store compaction"""
+    assignments = assign_clusters(matrix, centroids)
+    list_rows = np.argsort(assignments, kind="stable")
+    list_offsets = np.zeros(len(centroids) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(assignments, minlength=len(centroids)), out=list_offsets[1:])
+    return IVFIndex(centroids, list_offsets, list_rows)
+
+
+def save_index(index, base_version, directory=embedding_store.EMBEDDING_STORE_DIR, prefix=""):
+    """Save the index, tagged with the version and row count of the store it was built from"""
+    path = os.path.join(directory, prefix + IVF_FILE)
+    np.savez(path, centroids=index.centroids, list_offsets=index.list_offsets, list_rows=index.list_rows,
+             base_version=np.int64(-1 if base_version is None else base_version),
+             base_rows=np.int64(len(index.list_rows)))
+    return path
+
+
+def load_index(store, directory=embedding_store.EMBEDDING_STORE_DIR):
+    """Load the saved IVF index of `store`; None if it has not been built or was built for another store"""
+    path = os.path.join(directory, IVF_FILE)
+    if store is None or not os.path.exists(path):
+        return None
+    with np.load(path) as data:
+        if not embedding_store.built_for(data, store):
+            print(f"⚠️ Ignoring {path}: built for a different embedding store (run: python embedding_ann.py build)")
+            return None
+        return IVFIndex(data["centroids"], data["list_offsets"], data["list_rows"])
+
+
+def get_index():
+    """Return the process-wide IVF index, loading it on first use"""
+    global _index
+    if _index is None:
+        _index = load_index(embedding_store.get_store())
+    return _index
+
+
+def recall_report(store, index, k=10, nprobes=(1, 2, 4, 8, 16, 32), num_queries=200, seed=0):
+    """Measure recall@k and latency of the IVF index against exact search"""
+    rng = np.random.default_rng(seed)
+    query_rows = rng.choice(len(store), min(num_queries, len(store)), replace=False)
+
+    exact = []
+    start = time.time()
+    for row in query_rows:
+        scores = store.matrix @ store.matrix[row]
+        exact.append(set(embedding_store.top_k_indices(scores, k, exclude=row).tolist()))
+    exact_ms = (time.time() - start) / len(query_rows) * 1000
+
+    print(f"📊 Recall@{k} over {len(query_rows)} queries ({len(store)} embeddings, {index.nlist} lists)")
+    print(f"   exact          : recall 1.000, {exact_ms:.2f} ms/query")
+    report = []
+    for nprobe in nprobes:
+        if nprobe > index.nlist:
+            continue
+        hits = 0
+        start = time.time()
+        for row, truth in zip(query_rows, exact):
+            rows, _ = index.search(store.matrix, store.matrix[row], k, nprobe, exclude_row=row)
+            hits += len(truth & set(rows.tolist()))
+        ms = (time.time() - start) / len(query_rows) * 1000
+        recall = hits / max(1, sum(len(t) for t in exact))
+        report.append((nprobe, recall, ms))
+        print(f"   nprobe={nprobe:<7}: recall {recall:.3f}, {ms:.2f} ms/query")
+    return report
+
+
+if __name__ == "__main__":
+    import sys
+
+    store = embedding_store.load_store()
+    if store is None:
+        print("❌ Embedding store not built (run: python embedding_store.py)")
+        sys.exit(1)
+
+    if len(sys.argv) > 1 and sys.argv[1] == "recall":
+        index = load_index(store)
+        if index is None:
+            print("❌ IVF index not built for this store (run: python embedding_ann.py build)")
+            sys.exit(1)
+        k = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+        nprobes = [int(a) for a in sys.argv[3:]] or (1, 2, 4, 8, 16, 32)
+        recall_report(store, index, k, nprobes)
+    else:
+        nlist = int(sys.argv[2]) if len(sys.argv) > 2 else None
+        build_index(store, nlist)
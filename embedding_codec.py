@@ -0,0 +1,58 @@
+"""
+Binary storage format for Movie.embedding_vector
+
+An embedding is stored as a 12-byte header followed by raw little-endian
+float32 values:
+
+    magic b"EMBV" | uint16 format version | uint16 reserved | uint32 dimension
+
+Rows written before the migration still hold a JSON list; decode_embedding
+reads both so the switch can happen one batch at a time.
+"""
+
+import json
+import struct
+import numpy as np
+
+MAGIC = b"EMBV"
+FORMAT_VERSION = 1
+HEADER = struct.Struct("<4sHHI")
+FLOAT32_LE = np.dtype("<f4")
+
+
+def encode_embedding(vector):
+    """Pack an embedding (list or array) into header + float32 bytes"""
+    values = np.asarray(vector, dtype=FLOAT32_LE)
+    if values.ndim != 1:
+        raise ValueError(f"Embedding must be one-dimensional, got shape {values.shape}")
+    return HEADER.pack(MAGIC, FORMAT_VERSION, 0, len(values)) + values.tobytes()
+
+
+def is_binary_embedding(value):
+    return isinstance(value, (bytes, bytearray, memoryview)) and bytes(value[:4]) == MAGIC
+
+
+def decode_embedding(value):
+    """
+    Return a stored embedding as a float32 array, or None if the column is empty
+
+    Accepts the binary format and legacy JSON text; raises ValueError on
+    anything else so callers can skip the row the way they skip bad JSON.
+    """
+    if value is None or len(value) == 0:
+        return None
+
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        if len(value) < HEADER.size:
+            raise ValueError("Embedding blob is shorter than its header")
+        magic, version, _, dim = HEADER.unpack_from(value)
+        if magic != MAGIC:
+            # A JSON string that ended up stored as a blob
+            return np.asarray(json.loads(bytes(value).decode("utf-8")), dtype=np.float32)
+        if version != FORMAT_VERSION:
+            raise ValueError(f"Unsupported embedding format version {version}")
+        if len(value) != HEADER.size + dim * FLOAT32_LE.itemsize:
+            raise ValueError(f"Embedding blob size does not match dimension {dim}")
+        return np.frombuffer(value, dtype=FLOAT32_LE, count=dim, offset=HEADER.size).astype(np.float32)
+
+    return np.asarray(json.loads(value), dtype=np.float32)
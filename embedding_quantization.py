@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+"""
+Compressed embedding representations with exact re-ranking
+
+The whole catalog is scanned in a compact form (float16, int8 scalar
+quantization or PCA-reduced float32). Only the best `k * RERANK_FACTOR`
+candidates are then re-scored against the full-precision memory-mapped store.
+Just those rows are paged in.
+
+    python embedding_quantization.py build [float16|int8|pca] [pca_dims]
+    python embedding_quantization.py report [k]
+"""
+
+import os
+import time
+import numpy as np
+import embedding_store
+
+EMBEDDING_COMPRESSION = os.getenv("EMBEDDING_COMPRESSION", "none")  # none, float16, int8 or pca
+RERANK_FACTOR = int(os.getenv("EMBEDDING_RERANK_FACTOR", "10"))
+PCA_DIMS = int(os.getenv("EMBEDDING_PCA_DIMS", "256"))
+COMPRESSION_KINDS = ("float16", "int8", "pca")
+BLOCK_SIZE = 8192
+
+# Loaded compressed matrix, shared by every request in this process
+_compressed = None
+
+
+class CompressedEmbeddings:
+    """Store-aligned compressed codes that can approximately score a query"""
+
+    def __init__(self, kind, codes, scale=None, projection=None):
+        self.kind = kind
+        self.codes = codes            # (n, dim) float16/int8, or (n, pca_dims) float32
+        self.scale = scale            # int8: per-dimension dequantization scale
+        self.projection = projection  # pca: (dim, pca_dims) float32
+
+    @property
+    def nbytes(self):
+        extra = sum(a.nbytes for a in (self.scale, self.projection) if a is not None)
+        return self.codes.nbytes + extra
+
+    def approximate_scores(self, query):
+        """Approximate cosine similarity of a unit query against every row"""
+        if self.kind == "int8":
+            query = query * self.scale  # fold dequantization into the query
+        elif self.kind == "pca":
+            query = query @ self.projection
+        query = query.astype(np.float32)
+
+        scores = np.empty(len(self.codes), dtype=np.float32)
+        for start in range(0, len(self.codes), BLOCK_SIZE):
+            block = self.codes[start:start + BLOCK_SIZE].astype(np.float32)
+            scores[start:start + BLOCK_SIZE] = block @ query
+        return scores
+
+    def search(self, matrix, query, k, exclude_row=None, rerank_factor=RERANK_FACTOR):
+        """Approximate top k * rerank_factor, then exact re-rank against the full matrix"""
+        scores = self.approximate_scores(query)
+        candidates = embedding_store.top_k_indices(scores, k * max(1, rerank_factor), exclude=exclude_row)
+        if len(candidates) == 0:
+            return candidates, np.empty(0, dtype=np.float32)
+        candidates.sort()  # sequential access into the memmap
+        exact = matrix[candidates] @ query
+        best = embedding_store.top_k_indices(exact, k)
+        return candidates[best], exact[best]
+
+
+def compress(matrix, kind, pca_dims=PCA_DIMS, train_size=20000, seed=0):
+    """Build a compressed copy of a (unit-row) float32 matrix"""
+    if kind == "float16":
+        codes = np.empty(matrix.shape, dtype=np.float16)
+        for start in range(0, len(matrix), BLOCK_SIZE):
+            codes[start:start + BLOCK_SIZE] = matrix[start:start + BLOCK_SIZE]
+        return CompressedEmbeddings(kind, codes)
+
+    if kind == "int8":
+        max_abs = np.zeros(matrix.shape[1], dtype=np.float32)
+        for start in range(0, len(matrix), BLOCK_SIZE):
+            np.maximum(max_abs, np.abs(matrix[start:start + BLOCK_SIZE]).max(axis=0), out=max_abs)
+        scale = np.where(max_abs > 0, max_abs / 127.0, 1.0).astype(np.float32)
+        codes = np.empty(matrix.shape, dtype=np.int8)
+        for start in range(0, len(matrix), BLOCK_SIZE):
+            block = np.asarray(matrix[start:start + BLOCK_SIZE]) / scale
+            codes[start:start + BLOCK_SIZE] = np.clip(np.rint(block), -127, 127)
+        return CompressedEmbeddings(kind, codes, scale=scale)
+
+    if kind == "pca":
+        # Uncentered PCA: the top right-singular vectors best preserve inner products
+        rng = np.random.default_rng(seed)
+        sample = np.sort(rng.choice(len(matrix), min(train_size, len(matrix)), replace=False))
+        _, _, vt = np.linalg.svd(np.asarray(matrix[sample], dtype=np.float32), full_matrices=False)
+        projection = np.ascontiguousarray(vt[:min(pca_dims, vt.shape[0])].T, dtype=np.float32)
+        codes = np.empty((len(matrix), projection.shape[1]), dtype=np.float32)
+        for start in range(0, len(matrix), BLOCK_SIZE):
+            codes[start:start + BLOCK_SIZE] = matrix[start:start + BLOCK_SIZE] @ projection
+        return CompressedEmbeddings(kind, codes, projection=projection)
+
+    raise ValueError(f"Unknown compression kind: {kind}")
+
+
+def compressed_path(kind, directory=embedding_store.EMBEDDING_STORE_DIR):
+    return os.path.join(directory, f"compressed_{kind}.npz")
+
+
+def save_compressed(compressed, base_version, directory=embedding_store.EMBEDDING_STORE_DIR, prefix=""):
+    """Save the codes, tagged with the version and row count of the store they were built from"""
+    arrays = {
+        "codes": compressed.codes,
+        "base_version": np.int64(-1 if base_version is None else base_version),
+        "base_rows": np.int64(len(compressed.codes)),
+    }
+    if compressed.scale is not None:
+        arrays["scale"] = compressed.scale
+    if compressed.projection is not None:
+        arrays["projection"] = compressed.projection
+    path = os.path.join(directory, prefix + os.path.basename(compressed_path(compressed.kind, directory)))
+    np.savez(path, **arrays)
+    return path
+
+
+def load_compressed(kind, store, directory=embedding_store.EMBEDDING_STORE_DIR):
+    """Load the saved compressed matrix of `store`; None if not built or built for another store"""
+    path = compressed_path(kind, directory)
+    if store is None or not os.path.exists(path):
+        return None
+    with np.load(path) as data:
+        if not embedding_store.built_for(data, store):
+            print(f"⚠️ Ignoring {path}: built for a different embedding store "
+                  f"(run: python embedding_quantization.py build {kind})")
+            return None
+        return CompressedEmbeddings(
+            kind,
+            data["codes"],
+            scale=data["scale"] if "scale" in data else None,
+            projection=data["projection"] if "projection" in data else None,
+        )
+
+
+def get_compressed():
+    """Return the configured compressed matrix, or None when compression is off"""
+    global _compressed
+    if EMBEDDING_COMPRESSION not in COMPRESSION_KINDS:
+        return None
+    if _compressed is None:
+        _compressed = load_compressed(EMBEDDING_COMPRESSION, embedding_store.get_store())
+    return _compressed
+
+
+def tradeoff_report(store, k=10, kinds=COMPRESSION_KINDS, num_queries=200, seed=0):
+    """Report memory, recall@k (before and after re-rank) and latency for every kind"""
+    rng = np.random.default_rng(seed)
+    query_rows = rng.choice(len(store), min(num_queries, len(store)), replace=False)
+    float64_mb = len(store) * store.dim * 8 / 1e6
+
+    exact = []
+    start = time.time()
+    for row in query_rows:
+        scores = store.matrix @ store.matrix[row]
+        exact.append(set(embedding_store.top_k_indices(scores, k, exclude=row).tolist()))
+    exact_ms = (time.time() - start) / len(query_rows) * 1000
+    truth_total = max(1, sum(len(t) for t in exact))
+
+    print(f"📊 Recall@{k} over {len(query_rows)} queries ({len(store)} x {store.dim} embeddings)")
+    print(f"   {'mode':<10} {'memory':>10} {'vs f64':>7} {'raw recall':>11} {'reranked':>9} {'ms/query':>9}")
+    print(f"   {'float64':<10} {float64_mb:>8.1f}MB {1.0:>6.2f}x {'-':>11} {'-':>9} {'-':>9}")
+    print(f"   {'float32':<10} {store.matrix.nbytes / 1e6:>8.1f}MB {store.matrix.nbytes / 1e6 / float64_mb:>6.2f}x "
+          f"{1.0:>11.3f} {1.0:>9.3f} {exact_ms:>9.2f}")
+
+    report = []
+    for kind in kinds:
+        compressed = compress(store.matrix, kind)
+        raw_hits = reranked_hits = 0
+        start = time.time()
+        for row, truth in zip(query_rows, exact):
+            rows, _ = compressed.search(store.matrix, store.matrix[row], k, exclude_row=row)
+            reranked_hits += len(truth & set(rows.tolist()))
+        ms = (time.time() - start) / len(query_rows) * 1000
+        for row, truth in zip(query_rows, exact):
+            raw = embedding_store.top_k_indices(compressed.approximate_scores(store.matrix[row]), k, exclude=row)
+            raw_hits += len(truth & set(raw.tolist()))
+        mb = compressed.nbytes / 1e6
+        label = f"pca{compressed.codes.shape[1]}" if kind == "pca" else kind
+        print(f"   {label:<10} {mb:>8.1f}MB {mb / float64_mb:>6.2f}x {raw_hits / truth_total:>11.3f} "
+              f"{reranked_hits / truth_total:>9.3f} {ms:>9.2f}")
+        report.append((label, mb, raw_hits / truth_total, reranked_hits / truth_total, ms))
+    return report
+
+
+if __name__ == "__main__":
+    import sys
+
+    store = embedding_store.load_store()
+    if store is None:
+        print("❌ Embedding store not built (run: python embedding_store.py)")
+        sys.exit(1)
+
+    if len(sys.argv) > 1 and sys.argv[1] == "report":
+        tradeoff_report(store, k=int(sys.argv[2]) if len(sys.argv) > 2 else 10)
+    else:
+        kind = sys.argv[2] if len(sys.argv) > 2 else "int8"
+        pca_dims = int(sys.argv[3]) if len(sys.argv) > 3 else PCA_DIMS
+        start = time.time()
+        compressed = compress(store.matrix, kind, pca_dims)
+        path = save_compressed(compressed, store.version)
+        print(f"✅ Saved {kind} embeddings to {path} ({compressed.nbytes / 1e6:.1f} MB) "
+              f"in {time.time() - start:.1f}s")
@@ -0,0 +1,345 @@
+#!/usr/bin/env python3
+"""
+Append-only, segment-based embedding index
+
+The built store (embedding_store.py) is the base segment. Every batch of newly
+generated embeddings is written as a small delta segment file, and running
+servers pick it up on their next refresh. Searches merge results across
+segments; the newest copy of a movie wins. A background compaction merges the
+base and all deltas into a new base, then re-derives the IVF lists and the
+compressed matrix when those are built.
+
+    python embedding_segments.py info
+    python embedding_segments.py compact
+"""
+
+import fcntl
+import os
+import threading
+import time
+import numpy as np
+import embedding_store
+import embedding_ann
+import embedding_quantization
+
+SEGMENTS_DIR = os.path.join(embedding_store.EMBEDDING_STORE_DIR, "segments")
+SEGMENT_REFRESH_SECONDS = float(os.getenv("EMBEDDING_SEGMENT_REFRESH_SECONDS", "5"))
+COMPACT_MIN_SEGMENTS = int(os.getenv("EMBEDDING_COMPACT_SEGMENTS", "8"))
+COMPACT_INTERVAL_SECONDS = float(os.getenv("EMBEDDING_COMPACT_INTERVAL_SECONDS", "60"))
+COMPACT_LOCK_FILE = "compact.lock"
+
+# Process-wide index and background compaction thread
+_index = None
+_index_lock = threading.Lock()
+_compaction_thread = None
+
+
+def write_segment(movie_ids, vectors, directory=SEGMENTS_DIR):
+    """Write a batch of raw embeddings as a new delta segment; returns its path or None"""
+    ids, rows = [], []
+    for movie_id, vector in zip(movie_ids, vectors):
+        vec = embedding_store.normalize(vector)
+        if vec is not None:
+            ids.append(movie_id)
+            rows.append(vec)
+    if not rows:
+        return None
+
+    os.makedirs(directory, exist_ok=True)
+    order = np.argsort(ids, kind="stable")
+    name = f"segment-{time.time_ns()}-{os.getpid()}.npz"
+    tmp_path = os.path.join(directory, "tmp_" + name)
+    with open(tmp_path, "wb") as f:
+        np.savez(f, movie_ids=np.asarray(ids, dtype=np.int64)[order],
+                 matrix=np.asarray(rows, dtype=np.float32)[order])
+    path = os.path.join(directory, name)
+    os.replace(tmp_path, path)
+    return path
+
+
+def list_segments(directory=SEGMENTS_DIR):
+    """Segment file names, oldest first"""
+    if not os.path.isdir(directory):
+        return []
+    return sorted(f for f in os.listdir(directory) if f.startswith("segment-") and f.endswith(".npz"))
+
+
+def load_segment(name, directory=SEGMENTS_DIR):
+    with np.load(os.path.join(directory, name)) as data:
+        movie_ids, matrix = data["movie_ids"], data["matrix"]
+    # A movie embedded twice in one batch keeps its last vector
+    _, last = np.unique(movie_ids[::-1], return_index=True)
+    keep = np.sort(len(movie_ids) - 1 - last)
+    return embedding_store.EmbeddingStore(movie_ids[keep], matrix[keep])
+
+
+class SegmentedEmbeddingIndex:
+    """Immutable snapshot of the base store, its IVF/compressed views and delta segments"""
+
+    def __init__(self, base, segments, ivf=None, compressed=None, base_version=None):
+        self.base = base                # EmbeddingStore or None
+        self.segments = segments        # list of (name, EmbeddingStore), oldest first
+        self.ivf = ivf                  # IVFIndex over base rows, or None
+        self.compressed = compressed    # CompressedEmbeddings over base rows, or None
+        self.base_version = base_version
+        self.checked_at = time.time()
+
+        # Newest copy wins: mask rows whose movie reappears in a later segment
+        later_ids = np.empty(0, dtype=np.int64)
+        self.shadowed = []
+        for _, segment in reversed(segments):
+            self.shadowed.append(np.isin(segment.movie_ids, later_ids))
+            later_ids = np.union1d(later_ids, segment.movie_ids)
+        self.shadowed.reverse()
+        if base is not None:
+            self.base_shadowed_rows = np.flatnonzero(np.isin(base.movie_ids, later_ids))
+        else:
+            self.base_shadowed_rows = np.empty(0, dtype=np.int64)
+
+    def __len__(self):
+        base_rows = 0 if self.base is None else len(self.base) - len(self.base_shadowed_rows)
+        return base_rows + sum(int((~mask).sum()) for mask in self.shadowed)
+
+    @property
+    def segment_names(self):
+        return [name for name, _ in self.segments]
+
+    @property
+    def delta_rows(self):
+        return sum(len(segment) for _, segment in self.segments)
+
+    def vector(self, movie_id):
+        """Newest normalized embedding of a movie, or None"""
+        for _, segment in reversed(self.segments):
+            vector = segment.vector(movie_id)
+            if vector is not None:
+                return vector
+        return None if self.base is None else self.base.vector(movie_id)
+
+    def search_base(self, query, k, exclude_rows=None, nprobe=None):
+        """Top k base rows via the IVF index, the compressed scan or exact search, never `exclude_rows`"""
+        if self.ivf is not None and embedding_ann.EMBEDDING_SEARCH_MODE == "ivf":
+            return self.ivf.search(self.base.matrix, query, k, nprobe or embedding_ann.IVF_NPROBE, exclude_rows)
+        if self.compressed is not None:
+            return self.compressed.search(self.base.matrix, query, k, exclude_rows)
+        return self.base.search(query, k, exclude_rows)
+
+    def search(self, query, k, exclude_id=None, nprobe=None):
+        """Return [(movie_id, similarity), ...] of the k nearest movies across all segments"""
+        hits = []
+        if self.base is not None and len(self.base):
+            # Shadowed rows are masked before the top k, like the excluded movie
+            exclude_rows = self.base_shadowed_rows
+            exclude_row = None if exclude_id is None else self.base.row_of(exclude_id)
+            if exclude_row is not None:
+                exclude_rows = np.union1d(exclude_rows, [exclude_row])
+            rows, scores = self.search_base(query, k, exclude_rows if len(exclude_rows) else None, nprobe)
+            hits.extend(zip(self.base.movie_ids[rows].tolist(), scores.tolist()))
+
+        for (_, segment), shadowed in zip(self.segments, self.shadowed):
+            similarities = segment.matrix @ query
+            similarities[shadowed] = -np.inf
+            if exclude_id is not None:
+                similarities[segment.movie_ids == exclude_id] = -np.inf
+            rows = embedding_store.top_k_indices(similarities, k)
+            rows = rows[np.isfinite(similarities[rows])]
+            hits.extend(zip(segment.movie_ids[rows].tolist(), similarities[rows].tolist()))
+
+        hits.sort(key=lambda hit: -hit[1])
+        return hits[:k]
+
+    def batch_search(self, queries, k, exclude_ids=None, query_block=256):
+        """search() for many queries at once with blocked matrix-matrix products"""
+        queries = np.asarray(queries, dtype=np.float32)
+        results = [[] for _ in range(len(queries))]
+        exclude_ids = np.full(len(queries), -1, dtype=np.int64) if exclude_ids is None \
+            else np.asarray(exclude_ids, dtype=np.int64)
+
+        if self.base is not None and len(self.base):
+            rows_of = np.searchsorted(self.base.movie_ids, exclude_ids)
+            rows_of = np.minimum(rows_of, len(self.base) - 1)
+            exclude_rows = np.where(self.base.movie_ids[rows_of] == exclude_ids, rows_of, -1)
+            top_rows, top_scores = embedding_store.batch_top_k(
+                self.base.matrix, queries, k,
+                exclude_rows=exclude_rows, query_block=query_block, mask_rows=self.base_shadowed_rows
+            )
+            keep = np.isfinite(top_scores)
+            for i in range(len(queries)):
+                results[i].extend(zip(self.base.movie_ids[top_rows[i][keep[i]]].tolist(),
+                                      top_scores[i][keep[i]].tolist()))
+
+        for (_, segment), shadowed in zip(self.segments, self.shadowed):
+            similarities = queries @ segment.matrix.T
+            similarities[:, shadowed] = -np.inf
+            similarities[segment.movie_ids[np.newaxis, :] == exclude_ids[:, np.newaxis]] = -np.inf
+            for i in range(len(queries)):
+                rows = embedding_store.top_k_indices(similarities[i], k)
+                rows = rows[np.isfinite(similarities[i][rows])]
+                results[i].extend(zip(segment.movie_ids[rows].tolist(), similarities[i][rows].tolist()))
+
+        for hits in results:
+            hits.sort(key=lambda hit: -hit[1])
+            del hits[k:]
+        return results
+
+
+def base_version(directory=embedding_store.EMBEDDING_STORE_DIR):
+    """Modification time of the base ids file; changes whenever the base is rebuilt or compacted"""
+    try:
+        return os.stat(os.path.join(directory, embedding_store.IDS_FILE)).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+def load_index(previous=None):
+    """Build a snapshot, reusing the base and already-loaded segments of `previous`"""
+    version = base_version()
+    if previous is not None and previous.base_version == version:
+        base, ivf, compressed = previous.base, previous.ivf, previous.compressed
+        loaded = dict(previous.segments)
+    else:
+        base = embedding_store.reload_store()
+        # Derived files built for another version of the base are ignored (None)
+        ivf = embedding_ann.load_index(base)
+        compressed = None
+        if embedding_quantization.EMBEDDING_COMPRESSION in embedding_quantization.COMPRESSION_KINDS:
+            compressed = embedding_quantization.load_compressed(embedding_quantization.EMBEDDING_COMPRESSION, base)
+        embedding_ann._index = ivf
+        embedding_quantization._compressed = compressed
+        loaded = {}
+
+    segments = []
+    for name in list_segments():
+        if name not in loaded:
+            try:
+                loaded[name] = load_segment(name)
+            except (OSError, ValueError, KeyError) as e:
+                # Removed by a concurrent compaction or half-written; the next refresh settles it
+                print(f"⚠️ Skipping embedding segment {name}: {e}")
+                continue
+        segments.append((name, loaded[name]))
+
+    if base is None and not segments:
+        return None
+    return SegmentedEmbeddingIndex(base, segments, ivf, compressed, version)
+
+
+def get_index(force_refresh=False):
+    """Return the process-wide snapshot, picking up new segments every few seconds"""
+    global _index
+    with _index_lock:
+        stale = _index is None or time.time() - _index.checked_at >= SEGMENT_REFRESH_SECONDS
+        if force_refresh or stale:
+            current = _index
+            if current is not None and not force_refresh:
+                if current.base_version == base_version() and current.segment_names == list_segments():
+                    current.checked_at = time.time()
+                    return current
+            _index = load_index(current)
+        return _index
+
+
+def compact(directory=embedding_store.EMBEDDING_STORE_DIR, block_size=8192):
+    """Merge the base store and every current delta segment into a new base"""
+    # flock, not O_EXCL: the kernel drops the lock when its process dies, so a
+    # compaction killed mid-way cannot leave a lock behind that blocks every later run
+    os.makedirs(directory, exist_ok=True)
+    lock_fd = os.open(os.path.join(directory, COMPACT_LOCK_FILE), os.O_CREAT | os.O_WRONLY)
+    try:
+        fcntl.flock(lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        os.close(lock_fd)
+        print("⏳ Embedding compaction already running in another process")
+        return False
+
+    try:
+        start = time.time()
+        snapshot = load_index()
+        if snapshot is None or not snapshot.segments:
+            return False
+
+        sources = ([snapshot.base] if snapshot.base is not None else []) + [s for _, s in snapshot.segments]
+        all_ids = np.concatenate([s.movie_ids for s in sources])
+        source_of = np.concatenate([np.full(len(s), i) for i, s in enumerate(sources)])
+        row_of = np.concatenate([np.arange(len(s)) for s in sources])
+
+        # Sources are ordered oldest to newest: keep the last occurrence of every id
+        unique_ids, last = np.unique(all_ids[::-1], return_index=True)
+        picked = len(all_ids) - 1 - last
+
+        matrix = np.lib.format.open_memmap(
+            os.path.join(directory, "tmp_" + embedding_store.MATRIX_FILE),
+            mode="w+", dtype=np.float32, shape=(len(unique_ids), sources[0].dim)
+        )
+        for out_start in range(0, len(picked), block_size):
+            block = picked[out_start:out_start + block_size]
+            for i, source in enumerate(sources):
+                mask = source_of[block] == i
+                if mask.any():
+                    matrix[out_start + np.flatnonzero(mask)] = source.matrix[row_of[block[mask]]]
+        matrix.flush()
+
+        # Re-derive the IVF lists and compressed codes for the new rows as tmp_ files,
+        # tagged with the new base version, and publish them together with the base
+        version = embedding_store.write_ids(directory, unique_ids)
+        derived = []
+        if snapshot.ivf is not None:
+            index = embedding_ann.index_from_centroids(snapshot.ivf.centroids, matrix)
+            embedding_ann.save_index(index, version, directory, prefix="tmp_")
+            derived.append(embedding_ann.IVF_FILE)
+        for kind in embedding_quantization.COMPRESSION_KINDS:
+            path = embedding_quantization.compressed_path(kind, directory)
+            if os.path.exists(path):
+                compressed = embedding_quantization.compress(matrix, kind)
+                embedding_quantization.save_compressed(compressed, version, directory, prefix="tmp_")
+                derived.append(os.path.basename(path))
+        del matrix
+
+        embedding_store.publish_store(directory, derived=derived)
+        for name in snapshot.segment_names:
+            try:
+                os.remove(os.path.join(SEGMENTS_DIR, name))
+            except FileNotFoundError:
+                pass
+
+        print(f"✅ Compacted {len(snapshot.segments)} segments into {len(unique_ids)} embeddings "
+              f"in {time.time() - start:.1f}s")
+        get_index(force_refresh=True)
+        return True
+    finally:
+        os.close(lock_fd)  # releases the lock
+
+
+def start_background_compaction(interval=COMPACT_INTERVAL_SECONDS, min_segments=COMPACT_MIN_SEGMENTS):
+    """Start a daemon thread that compacts once enough delta segments pile up"""
+    global _compaction_thread
+    if _compaction_thread is not None and _compaction_thread.is_alive():
+        return _compaction_thread
+
+    def run():
+        while True:
+            time.sleep(interval)
+            try:
+                if len(list_segments()) >= min_segments:
+                    compact()
+            except Exception as e:
+                print(f"❌ Embedding compaction failed: {e}")
+
+    _compaction_thread = threading.Thread(target=run, name="embedding-compaction", daemon=True)
+    _compaction_thread.start()
+    return _compaction_thread
+
+
+if __name__ == "__main__":
+    import sys
+
+    if len(sys.argv) > 1 and sys.argv[1] == "compact":
+        compact()
+    else:
+        index = load_index()
+        if index is None:
+            print("❌ No embedding store or segments built")
+        else:
+            base_rows = 0 if index.base is None else len(index.base)
+            print(f"📊 {len(index)} searchable embeddings: base {base_rows} rows, "
+                  f"{len(index.segments)} delta segments with {index.delta_rows} rows")
@@ -3,10 +3,13 @@
 Embedding-based movie recommendation using cosine similarity - OPTIMIZED
 """
 
-import json
+import time
 import numpy as np
 from database import get_db
 from models import Movie
+from embedding_codec import decode_embedding
+import embedding_store
+import embedding_segments
 
 def cosine_similarity_embeddings(vec1, vec2):
     """Calculate cosine similarity between two vectors using NumPy"""
@@ -30,12 +33,23 @@ def cosine_similarity_embeddings(vec1, vec2):
         print(f"Error calculating cosine similarity: {e}")
         return 0.0
 
-def cosine_similarity_matrix(base_embedding, all_embeddings):
+def cosine_similarity_matrix(base_embedding, all_embeddings, normalized=False):
     """
     Calculate cosine similarity between base embedding and all other embeddings at once
     This is much faster than pairwise comparisons
+
+    With normalized=True, all_embeddings is taken to be a matrix of unit rows
+    (e.g. the memory-mapped embedding store) and the whole computation is a
+    single float32 matrix-vector product with no copy of the matrix.
     """
     try:
+        if normalized:
+            base_vec = np.asarray(base_embedding, dtype=np.float32)
+            base_norm = np.linalg.norm(base_vec)
+            if base_norm == 0:
+                return np.zeros(len(all_embeddings), dtype=np.float32)
+            return all_embeddings @ (base_vec / base_norm)
+
         # Convert to numpy arrays
         base_vec = np.array(base_embedding, dtype=np.float64)
         all_vecs = np.array(all_embeddings, dtype=np.float64)
@@ -68,17 +82,77 @@ def cosine_similarity_matrix(base_embedding, all_embeddings):
         print(f"Error in vectorized cosine similarity: {e}")
         return np.zeros(len(all_embeddings))
 
-def get_embedding_based_recommendations(movie_id, num_recommendations=4):
+def movie_to_recommendation(movie, similarity):
+    """Shape a Movie row into the recommendation dict returned by this module"""
+    return {
+        'id': movie.id,
+        'title': movie.title,
+        'similarity_score': float(similarity),
+        'genres': movie.genres if movie.genres else "",
+        'overview': movie.overview if movie.overview else "",
+        'release_date': movie.release_date if movie.release_date else "",
+        'vote_average': movie.vote_average,
+        'poster_path': movie.poster_path
+    }
+
+def get_base_embedding(movie_id, db, index=None):
+    """Return the base movie's embedding, from the index when possible, else from its row"""
+    if index is not None:
+        vector = index.vector(movie_id)
+        if vector is not None:
+            return vector
+    raw_vector = db.query(Movie.embedding_vector).filter(Movie.id == movie_id).scalar()
+    if not raw_vector:
+        return None
+    try:
+        return decode_embedding(raw_vector)
+    except Exception as e:
+        print(f"❌ Error parsing embedding for movie {movie_id}: {e}")
+        return None
+
+def fetch_recommendations(hits, db):
+    """Load the Movie rows of [(movie_id, similarity), ...] in one query, keeping the order"""
+    movies = db.query(Movie).filter(Movie.id.in_([movie_id for movie_id, _ in hits])).all()
+    id_to_movie = {movie.id: movie for movie in movies}
+
+    recommendations = []
+    for movie_id, similarity in hits:
+        movie = id_to_movie.get(movie_id)
+        if movie:
+            recommendations.append(movie_to_recommendation(movie, similarity))
+            print(f"🎬 {len(recommendations)}. {movie.title} (Similarity: {similarity:.4f})")
+    return recommendations
+
+def get_index_recommendations(movie_id, num_recommendations, db, index, nprobe=None):
+    """Rank the segmented embedding index against the base movie and fetch only the winners"""
+    base_embedding = get_base_embedding(movie_id, db, index)
+    query = None if base_embedding is None else embedding_store.normalize(base_embedding)
+    if query is None:
+        print(f"❌ Movie {movie_id} has no embedding vector")
+        return []
+
+    hits = index.search(query, num_recommendations, exclude_id=movie_id, nprobe=nprobe)
+    return fetch_recommendations(hits, db)
+
+def get_embedding_based_recommendations(movie_id, num_recommendations=4, nprobe=None):
     """
     Get movie recommendations based on embedding similarity - OPTIMIZED VERSION
     
     Args:
         movie_id: ID of the base movie
         num_recommendations: Number of recommendations to return
+        nprobe: IVF clusters to scan when EMBEDDING_SEARCH_MODE=ivf (recall/latency knob)
     
     Returns:
         List of recommended movies with similarity scores
     """
+    index = embedding_segments.get_index()
+    if index is not None:
+        with get_db() as db:
+            return get_index_recommendations(movie_id, num_recommendations, db, index, nprobe)
+
+    # No store built yet: fall back to parsing every embedding from the database
+    print("⚠️ Embedding store not built, scanning database (run: python embedding_store.py)")
     with get_db() as db:
         # Get the base movie
         base_movie = db.query(Movie).filter(Movie.id == movie_id).first()
@@ -93,7 +167,7 @@ def get_embedding_based_recommendations(movie_id, num_recommendations=4):
         
         try:
             # Parse the base movie's embedding
-            base_embedding = json.loads(base_movie.embedding_vector)
+            base_embedding = decode_embedding(base_movie.embedding_vector)
         except Exception as e:
             print(f"❌ Error parsing embedding for movie '{base_movie.title}': {e}")
             return []
@@ -120,7 +194,7 @@ def get_embedding_based_recommendations(movie_id, num_recommendations=4):
         
         for movie in movies_with_embeddings:
             try:
-                movie_embedding = json.loads(movie.embedding_vector)
+                movie_embedding = decode_embedding(movie.embedding_vector)
                 all_embeddings.append(movie_embedding)
                 valid_movies.append(movie)
             except Exception as e:
@@ -146,21 +220,64 @@ def get_embedding_based_recommendations(movie_id, num_recommendations=4):
         # Get top recommendations
         recommendations = []
         for i, (movie, similarity) in enumerate(movie_similarities[:num_recommendations]):
-            recommendations.append({
-                'id': movie.id,
-                'title': movie.title,
-                'similarity_score': similarity,
-                'genres': movie.genres if movie.genres else "",
-                'overview': movie.overview if movie.overview else "",
-                'release_date': movie.release_date if movie.release_date else "",
-                'vote_average': movie.vote_average,
-                'poster_path': movie.poster_path
-            })
+            recommendations.append(movie_to_recommendation(movie, similarity))
             
             print(f"🎬 {i+1}. {movie.title} (Similarity: {similarity:.4f})")
         
         return recommendations
 
+def get_embedding_based_recommendations_batch(movie_ids, num_recommendations=4, block_size=256,
+                                              fetch_movies=True):
+    """
+    Get embedding recommendations for many movies with blocked matrix-matrix products
+
+    Args:
+        movie_ids: IDs of the base movies
+        num_recommendations: Number of recommendations per movie
+        block_size: Seed movies scored per block; bounds memory per block
+        fetch_movies: Load Movie rows for the full recommendation dicts (one query);
+            when False only 'id' and 'similarity_score' are returned (cache warming)
+
+    Returns:
+        Dict of movie_id -> list of recommendations, best first. Movies missing
+        from the embedding index map to an empty list.
+    """
+    index = embedding_segments.get_index()
+    if index is None:
+        print("❌ Embedding store not built (run: python embedding_store.py)")
+        return {movie_id: [] for movie_id in movie_ids}
+
+    results = {movie_id: [] for movie_id in movie_ids}
+    seeds = [(movie_id, index.vector(movie_id)) for movie_id in results]
+    seeds = [(movie_id, vector) for movie_id, vector in seeds if vector is not None]
+    if not seeds:
+        return results
+
+    all_hits = index.batch_search(
+        np.array([vector for _, vector in seeds]), num_recommendations,
+        exclude_ids=[movie_id for movie_id, _ in seeds], query_block=block_size
+    )
+
+    id_to_movie = {}
+    if fetch_movies:
+        unique_ids = sorted({neighbour_id for hits in all_hits for neighbour_id, _ in hits})
+        with get_db() as db:
+            for start in range(0, len(unique_ids), 900):  # stay under SQLite's bound-parameter limit
+                chunk = unique_ids[start:start + 900]
+                for movie in db.query(Movie).filter(Movie.id.in_(chunk)).all():
+                    id_to_movie[movie.id] = movie_to_recommendation(movie, 0.0)
+
+    for (movie_id, _), hits in zip(seeds, all_hits):
+        for neighbour_id, score in hits:
+            if fetch_movies:
+                if neighbour_id not in id_to_movie:
+                    continue
+                recommendation = dict(id_to_movie[neighbour_id], similarity_score=score)
+            else:
+                recommendation = {'id': neighbour_id, 'similarity_score': score}
+            results[movie_id].append(recommendation)
+    return results
+
 def test_embedding_similarity():
     """Test the embedding similarity algorithm"""
     print("🧪 Testing embedding similarity algorithm...")
@@ -188,5 +305,26 @@ def test_embedding_similarity():
         else:
             print("❌ No recommendations found")
 
+def benchmark_batch(num_seeds=1000, num_recommendations=10):
+    """Time the batch API over random seeds from the store"""
+    index = embedding_segments.get_index()
+    if index is None or index.base is None:
+        print("❌ Embedding store not built (run: python embedding_store.py)")
+        return
+    store = index.base
+
+    rng = np.random.default_rng(0)
+    seeds = store.movie_ids[rng.choice(len(store), min(num_seeds, len(store)), replace=False)].tolist()
+    start = time.time()
+    results = get_embedding_based_recommendations_batch(seeds, num_recommendations, fetch_movies=False)
+    elapsed = time.time() - start
+    print(f"⚡ {len(results)} seeds x top-{num_recommendations} in {elapsed:.2f}s "
+          f"({elapsed / len(results) * 1000:.2f} ms/seed)")
+
 if __name__ == "__main__":
-    test_embedding_similarity() 
\ No newline at end of file
+    import sys
+
+    if len(sys.argv) > 1 and sys.argv[1] == "batch":
+        benchmark_batch(int(sys.argv[2]) if len(sys.argv) > 2 else 1000)
+    else:
+        test_embedding_similarity() 
\ No newline at end of file
@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+"""
+Embedding store: every movie embedding in one contiguous, pre-normalized float32 matrix
+
+The matrix is written once to a .npy file and memory-mapped on load, so the
+query path never touches Movie ORM rows or parses JSON.
+"""
+
+import os
+import time
+import numpy as np
+from database import get_db
+from models import Movie
+from embedding_codec import decode_embedding
+
+EMBEDDING_STORE_DIR = os.getenv("EMBEDDING_STORE_DIR", "embedding_store")
+MATRIX_FILE = "embeddings.npy"
+IDS_FILE = "movie_ids.npy"
+
+# Loaded store, shared by every request in this process
+_store = None
+
+
+class EmbeddingStore:
+    """Row-aligned movie ids and L2-normalized float32 embedding matrix"""
+
+    def __init__(self, movie_ids, matrix, version=None):
+        self.movie_ids = movie_ids  # sorted int64 array, row i holds movie_ids[i]
+        self.matrix = matrix        # (n, dim) float32, usually a read-only memmap
+        self.version = version      # ids-file mtime of a saved store, None in memory
+
+    def __len__(self):
+        return len(self.movie_ids)
+
+    @property
+    def dim(self):
+        return self.matrix.shape[1]
+
+    @property
+    def nbytes(self):
+        return self.matrix.nbytes + self.movie_ids.nbytes
+
+    def row_of(self, movie_id):
+        """Return the matrix row of a movie, or None if it is not in the store"""
+        row = int(np.searchsorted(self.movie_ids, movie_id))
+        if row < len(self.movie_ids) and self.movie_ids[row] == movie_id:
+            return row
+        return None
+
+    def vector(self, movie_id):
+        """Return the normalized embedding of a movie, or None"""
+        row = self.row_of(movie_id)
+        return None if row is None else self.matrix[row]
+
+    def search(self, query, k, exclude_row=None):
+        """Exact top k by cosine: one matrix-vector product over the unit rows"""
+        similarities = self.matrix @ query
+        rows = top_k_indices(similarities, k, exclude=exclude_row)
+        return rows, similarities[rows]
+
+
+def normalize(vector):
+    """Return a float32 unit vector, or None for a zero vector"""
+    vec = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(vec)
+    if norm == 0:
+        return None
+    return vec / norm
+
+
+def top_k_indices(similarities, k, exclude=None):
+    """Return indices of the k highest similarities, best first, without a full sort; `exclude` is a row or rows"""
+    excluded = 0
+    if exclude is not None:
+        similarities = similarities.copy()
+        similarities[exclude] = -np.inf
+        excluded = np.unique(exclude).size
+    k = min(k, len(similarities) - excluded)
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    candidates = np.argpartition(-similarities, k - 1)[:k]
+    return candidates[np.argsort(-similarities[candidates], kind="stable")]
+
+
+def batch_top_k(matrix, queries, k, exclude_rows=None, query_block=256, column_block=16384, mask_rows=None):
+    """
+    Top-k rows of matrix for every query row, best first
+
+    exclude_rows holds one row per query to leave out; mask_rows are left out
+    for every query. Scores are computed one (query_block x column_block)
+    tile at a time and merged into a running top-k, so peak extra memory is
+    about query_block * (column_block + 2k) floats whatever the catalog size.
+    """
+    n = len(matrix)
+    mask_rows = np.empty(0, dtype=np.int64) if mask_rows is None else np.unique(mask_rows)
+    k = min(k, n - len(mask_rows) - (0 if exclude_rows is None else 1))
+    top_rows = np.empty((len(queries), max(k, 0)), dtype=np.int64)
+    top_scores = np.empty((len(queries), max(k, 0)), dtype=np.float32)
+    if k <= 0:
+        return top_rows, top_scores
+
+    for q_start in range(0, len(queries), query_block):
+        q = np.asarray(queries[q_start:q_start + query_block], dtype=np.float32)
+        excluded = None if exclude_rows is None else np.asarray(exclude_rows[q_start:q_start + query_block])
+        best_rows = np.empty((len(q), 0), dtype=np.int64)
+        best_scores = np.empty((len(q), 0), dtype=np.float32)
+
+        for c_start in range(0, n, column_block):
+            scores = q @ np.asarray(matrix[c_start:c_start + column_block]).T
+            if excluded is not None:
+                local = excluded - c_start
+                hit = (local >= 0) & (local < scores.shape[1])
+                scores[np.flatnonzero(hit), local[hit]] = -np.inf
+            masked = mask_rows[(mask_rows >= c_start) & (mask_rows < c_start + scores.shape[1])]
+            scores[:, masked - c_start] = -np.inf
+
+            rows = np.broadcast_to(np.arange(c_start, c_start + scores.shape[1]), scores.shape)
+            merged_scores = np.concatenate([best_scores, scores], axis=1)
+            merged_rows = np.concatenate([best_rows, rows], axis=1)
+            if merged_scores.shape[1] > k:
+                keep = np.argpartition(-merged_scores, k - 1, axis=1)[:, :k]
+                merged_scores = np.take_along_axis(merged_scores, keep, axis=1)
+                merged_rows = np.take_along_axis(merged_rows, keep, axis=1)
+            best_scores, best_rows = merged_scores, merged_rows
+
+        order = np.argsort(-best_scores, axis=1, kind="stable")
+        top_rows[q_start:q_start + len(q)] = np.take_along_axis(best_rows, order, axis=1)
+        top_scores[q_start:q_start + len(q)] = np.take_along_axis(best_scores, order, axis=1)
+    return top_rows, top_scores
+
+
+def build_store(db, directory=EMBEDDING_STORE_DIR, batch_size=1000):
+    """Stream all embeddings from the database into a normalized float32 .npy file"""
+    start = time.time()
+    os.makedirs(directory, exist_ok=True)
+
+    total = db.query(Movie.id).filter(Movie.embedding_vector.isnot(None)).count()
+    print(f"📊 Found {total} movies with embeddings")
+    if total == 0:
+        print("❌ No embeddings to store")
+        return None
+
+    rows = (
+        db.query(Movie.id, Movie.embedding_vector)
+        .filter(Movie.embedding_vector.isnot(None))
+        .order_by(Movie.id)
+        .yield_per(batch_size)
+    )
+
+    tmp_matrix_path = os.path.join(directory, "tmp_" + MATRIX_FILE)
+    matrix = None
+    movie_ids = np.empty(total, dtype=np.int64)
+    written = 0
+
+    for movie_id, raw_vector in rows:
+        try:
+            vec = normalize(decode_embedding(raw_vector))
+        except Exception as e:
+            print(f"⚠️ Error parsing embedding for movie {movie_id}: {e}")
+            continue
+        if vec is None:
+            continue
+        if matrix is None:
+            matrix = np.lib.format.open_memmap(
+                tmp_matrix_path, mode="w+", dtype=np.float32, shape=(total, len(vec))
+            )
+        if len(vec) != matrix.shape[1]:
+            print(f"⚠️ Skipping movie {movie_id}: dimension {len(vec)} != {matrix.shape[1]}")
+            continue
+        matrix[written] = vec
+        movie_ids[written] = movie_id
+        written += 1
+
+    if matrix is None or written == 0:
+        print("❌ No valid embeddings found")
+        return None
+
+    if written < total:
+        # Some rows were skipped: copy the filled prefix into a right-sized file
+        trimmed = np.array(matrix[:written])
+        del matrix
+        np.save(tmp_matrix_path, trimmed)
+    else:
+        matrix.flush()
+        del matrix
+
+    publish_store(directory, movie_ids[:written])
+
+    store = load_store(directory)
+    print(f"✅ Stored {written} embeddings ({store.dim} dims, {store.nbytes / 1e6:.1f} MB) "
+          f"in {time.time() - start:.1f}s")
+    return store
+
+
+def write_ids(directory, movie_ids):
+    """
+    Write the tmp_ ids of a store about to be published; returns its version
+
+    The version is the file's mtime, which survives the rename in
+    publish_store(), so derived files can be tagged before publishing.
+    """
+    path = os.path.join(directory, "tmp_" + IDS_FILE)
+    np.save(path, movie_ids)
+    return os.stat(path).st_mtime_ns
+
+
+def publish_store(directory, movie_ids=None, derived=()):
+    """
+    Atomically swap the written tmp_ matrix, the tmp_ derived files and the ids into place
+
+    The ids go last: readers key on them, and files tagged with the new
+    version are ignored until the ids carrying it are in place.
+    """
+    if movie_ids is not None:
+        write_ids(directory, movie_ids)
+    os.replace(os.path.join(directory, "tmp_" + MATRIX_FILE), os.path.join(directory, MATRIX_FILE))
+    for name in derived:
+        os.replace(os.path.join(directory, "tmp_" + name), os.path.join(directory, name))
+    os.replace(os.path.join(directory, "tmp_" + IDS_FILE), os.path.join(directory, IDS_FILE))
+
+
+def built_for(data, store):
+    """True if a loaded derived .npz (IVF lists, compressed codes) was built from this exact store"""
+    return (
+        store is not None and store.version is not None
+        and "base_version" in data and int(data["base_version"]) == store.version
+        and int(data["base_rows"]) == len(store)
+    )
+
+
+def load_store(directory=EMBEDDING_STORE_DIR):
+    """Memory-map a previously built store, or return None if it has not been built"""
+    matrix_path = os.path.join(directory, MATRIX_FILE)
+    ids_path = os.path.join(directory, IDS_FILE)
+    if not (os.path.exists(matrix_path) and os.path.exists(ids_path)):
+        return None
+    version = os.stat(ids_path).st_mtime_ns
+    matrix = np.load(matrix_path, mmap_mode="r")
+    movie_ids = np.load(ids_path)
+    return EmbeddingStore(movie_ids, matrix, version)
+
+
+def get_store():
+    """Return the process-wide store, loading it on first use"""
+    global _store
+    if _store is None:
+        _store = load_store()
+    return _store
+
+
+def reload_store():
+    """Drop the cached store so the next get_store() maps the files again"""
+    global _store
+    _store = None
+    return get_store()
+
+
+if __name__ == "__main__":
+    import sys
+
+    if len(sys.argv) > 1 and sys.argv[1] == "info":
+        store = load_store()
+        if store is None:
+            print(f"❌ No embedding store in {EMBEDDING_STORE_DIR}/")
+        else:
+            print(f"📊 {len(store)} embeddings, {store.dim} dims, {store.nbytes / 1e6:.1f} MB")
+    else:
+        print("🔄 Building embedding store...")
+        with get_db() as db:
+            build_store(db)
@@ -1,7 +1,20 @@
-from sqlalchemy import func
+import os
+import threading
+import time
+from functools import lru_cache
+import numpy as np
+from sqlalchemy import select
 from sqlalchemy.orm import joinedload
-from models import Movie, Genre
-from database import get_db
+from models import Movie, Genre, movie_genre
+from database import get_db, movie_table_fingerprint, movie_votes_fingerprint, movie_genres_fingerprint
+from composite_features import popcount
+
+# Bitmasks hold one bit per genre id
+MAX_GENRES = 32
+# Distinct (genre signature, result size) rankings kept in memory
+GENRE_CACHE_SIZE = int(os.getenv("GENRE_CACHE_SIZE", "4096"))
+# How often recommend checks whether movies, votes or genre links changed since the index was built
+GENRE_INDEX_REFRESH_SECONDS = float(os.getenv("GENRE_INDEX_REFRESH_SECONDS", "30"))
 
 
 def get_movie_by_id(movie_id, db):
@@ -11,6 +24,104 @@ def get_movie_by_id(movie_id, db):
             .first())
 
 
+class GenreIndex:
+    """Per-movie uint32 genre bitmask, with ratings and vote counts for tie-breaking"""
+
+    def __init__(self, movie_ids, masks, ratings, votes, genre_bits, fingerprint=None):
+        self.movie_ids = movie_ids  # sorted int64
+        self.masks = masks
+        self.ratings = ratings
+        self.votes = votes
+        self.genre_bits = genre_bits  # genre id -> bit position
+        self.fingerprint = fingerprint  # genre_index_fingerprint the index was built at
+        self.checked_at = time.time()
+        # Memoized per index, so a cached ranking never outlives the index it came from
+        self.ranked_by_signature = lru_cache(maxsize=GENRE_CACHE_SIZE)(self.signature_ranking)
+
+    def __len__(self):
+        return len(self.movie_ids)
+
+    def mask_of(self, genre_ids):
+        mask = 0
+        for genre_id in genre_ids:
+            if genre_id in self.genre_bits:
+                mask |= 1 << self.genre_bits[genre_id]
+        return mask
+
+    def ranked(self, mask, count):
+        """
+        Movie ids sharing at least one genre with `mask`, best first
+
+        Most shared genres first, then higher vote_average, then higher
+        vote_count, then lower id.
+        """
+        overlap = popcount(self.masks & np.uint32(mask))
+        rows = np.flatnonzero(overlap)
+        order = np.lexsort((self.movie_ids[rows], -self.votes[rows], -self.ratings[rows], -overlap[rows]))
+        return self.movie_ids[rows[order[:count]]].tolist()
+
+    def signature_ranking(self, mask, count):
+        """ranked() as a tuple: most seeds share their genre set with many others"""
+        return tuple(self.ranked(mask, count))
+
+
+def genre_index_fingerprint(db):
+    return movie_table_fingerprint(db) + movie_votes_fingerprint(db) + movie_genres_fingerprint(db)
+
+
+def build_genre_index(db, fingerprint=None):
+    start = time.time()
+    fingerprint = fingerprint or genre_index_fingerprint(db)
+    rows = db.query(Movie.id, Movie.vote_average, Movie.vote_count).order_by(Movie.id).all()
+    movie_ids = np.array([r.id for r in rows], dtype=np.int64)
+    ratings = np.array([r.vote_average or 0.0 for r in rows], dtype=np.float64)
+    votes = np.array([r.vote_count or 0 for r in rows], dtype=np.int64)
+
+    genre_ids = [genre_id for genre_id, in db.query(Genre.id).order_by(Genre.id).all()]
+    if len(genre_ids) > MAX_GENRES:
+        raise ValueError(f"{len(genre_ids)} genres do not fit a {MAX_GENRES}-bit mask")
+    genre_bits = {genre_id: bit for bit, genre_id in enumerate(genre_ids)}
+
+    masks = np.zeros(len(rows), dtype=np.uint32)
+    pairs = db.execute(select(movie_genre.c.movie_id, movie_genre.c.genre_id)).all()
+    if pairs:
+        pair_movies = np.array([movie_id for movie_id, _ in pairs], dtype=np.int64)
+        pair_bits = np.array([1 << genre_bits[genre_id] if genre_id in genre_bits else 0
+                              for _, genre_id in pairs], dtype=np.uint32)
+        positions = np.searchsorted(movie_ids, pair_movies)
+        known = (positions < len(movie_ids)) & (movie_ids[np.minimum(positions, len(movie_ids) - 1)] == pair_movies)
+        np.bitwise_or.at(masks, positions[known], pair_bits[known])
+
+    index = GenreIndex(movie_ids, masks, ratings, votes, genre_bits, fingerprint)
+    print(f"[INFO] Genre index: {len(index)} movies, {len(genre_bits)} genres, "
+          f"{len(np.unique(masks))} distinct genre sets, built in {time.time() - start:.2f}s")
+    return index
+
+
+# Process-wide index, built by the startup warm-up or on first use and rebuilt
+# when genre_index_fingerprint changes
+genre_index = None
+_genre_index_lock = threading.Lock()
+
+
+def initialize_genre_index(db, fingerprint=None):
+    global genre_index
+    genre_index = build_genre_index(db, fingerprint)
+
+
+def get_genre_index(db):
+    """Return the genre index, rebuilding it if movies, votes or genre links changed since the last check"""
+    with _genre_index_lock:
+        if genre_index is not None and time.time() - genre_index.checked_at < GENRE_INDEX_REFRESH_SECONDS:
+            return genre_index
+        fingerprint = genre_index_fingerprint(db)
+        if genre_index is not None and genre_index.fingerprint == fingerprint:
+            genre_index.checked_at = time.time()
+        else:
+            initialize_genre_index(db, fingerprint)
+        return genre_index
+
+
 def recommend(movie_id: int, limit: int, db):
     base_movie = get_movie_by_id(movie_id, db)
     if not base_movie:
@@ -30,34 +141,20 @@ def recommend(movie_id: int, limit: int, db):
     for genre in base_genres:
         print(f"{genre.name}")
 
-    # to access the association table between movies and genres
-    MovieGenre = Movie.genres_rel.property.secondary
-
-    # use subquery to count how many genres each candidate movie shares with the base movie
-    subq = (
-        db.query(
-            Movie.id.label("movie_id"),
-            func.count(MovieGenre.c.genre_id)  #c. - to get columns
-            .label("common_genres")
-        )
-        .join(MovieGenre, Movie.id == MovieGenre.c.movie_id)
-        .filter(
-            Movie.id != movie_id,
-            MovieGenre.c.genre_id.in_(base_genre_ids)
-        )
-        .group_by(Movie.id)
-        .order_by(func.count(MovieGenre.c.genre_id).desc())   #sort descending by number of genres
-        .limit(limit)
-        .subquery()
-    )
+    index = get_genre_index(db)
+
+    # One extra id in case the seed itself ranks inside the top `limit`
+    ranked_ids = index.ranked_by_signature(index.mask_of(base_genre_ids), limit + 1)
+    recommended_ids = [rid for rid in ranked_ids if rid != movie_id][:limit]
 
-    # join with main Movie table to get full movie data
-    recommendations = (
+    movies = (
         db.query(Movie)
-        .join(subq, Movie.id == subq.c.movie_id)
+        .filter(Movie.id.in_(recommended_ids))
         .options(joinedload(Movie.genres_rel))  # to avoid N+1 query number
         .all()
     )
+    id_to_movie = {movie.id: movie for movie in movies}
+    recommendations = [id_to_movie[rid] for rid in recommended_ids if rid in id_to_movie]
 
     if not recommendations:
         print("No recommendations found.")
@@ -0,0 +1,78 @@
+"""
+Readiness registry for the in-memory indexes built after startup
+
+Each index moves pending -> warming -> ready (or unavailable / failed).
+Request handlers check is_ready() and show a "warming" placeholder instead
+of blocking on a build.
+"""
+
+import threading
+import time
+
+PENDING = "pending"
+WARMING = "warming"
+READY = "ready"
+UNAVAILABLE = "unavailable"  # nothing to load, e.g. the embedding store was never built
+FAILED = "failed"
+
+_lock = threading.Lock()
+_indexes = {}
+
+
+def register(name):
+    with _lock:
+        _indexes.setdefault(name, {"state": PENDING, "detail": None, "seconds": None})
+
+
+def set_state(name, state, detail=None, seconds=None):
+    with _lock:
+        _indexes[name] = {"state": state, "detail": detail, "seconds": seconds}
+
+
+def state(name):
+    with _lock:
+        entry = _indexes.get(name)
+        return entry["state"] if entry else None
+
+
+def is_ready(name):
+    return state(name) == READY
+
+
+def is_warming(name):
+    return state(name) in (PENDING, WARMING)
+
+
+def snapshot():
+    """Copy of every index state, for the /ready endpoint"""
+    with _lock:
+        return {name: dict(entry) for name, entry in _indexes.items()}
+
+
+def all_settled():
+    """True once no index is still pending or warming"""
+    with _lock:
+        return all(entry["state"] not in (PENDING, WARMING) for entry in _indexes.values())
+
+
+def warm(name, loader):
+    """
+    Run loader() and record the outcome for `name`
+
+    The loader returns a short detail string, or None if there was nothing to load.
+    """
+    set_state(name, WARMING)
+    start = time.time()
+    try:
+        detail = loader()
+    except Exception as e:
+        set_state(name, FAILED, f"{type(e).__name__}: {e}", round(time.time() - start, 3))
+        print(f"❌ Index '{name}' failed to load: {e}")
+        return
+    elapsed = round(time.time() - start, 3)
+    if detail is None:
+        set_state(name, UNAVAILABLE, None, elapsed)
+        print(f"⚠️ Index '{name}' unavailable ({elapsed}s)")
+    else:
+        set_state(name, READY, detail, elapsed)
+        print(f"✅ Index '{name}' ready in {elapsed}s: {detail}")
@@ -0,0 +1,73 @@
+"""
+Bounded LRU cache whose entries also expire after a TTL
+
+Each entry is stored with a tag, e.g. the movie table fingerprint. A lookup
+with a different tag is a miss that drops the stale entry, so a changed
+table invalidates the cache lazily, one key at a time. Hit, miss,
+eviction, expiry and invalidation counters are exposed via stats().
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUTTLCache:
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl  # seconds; 0 = entries never expire
+        self._entries = OrderedDict()  # key -> (tag, stored_at, value), least recently used first
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = self.expirations = self.invalidations = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, tag=None, default=None):
+        """The value cached for `key` under `tag`, or `default` (a miss)"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry_tag, stored_at, value = entry
+                if entry_tag != tag:
+                    del self._entries[key]
+                    self.invalidations += 1
+                elif self.ttl and time.monotonic() - stored_at > self.ttl:
+                    del self._entries[key]
+                    self.expirations += 1
+                else:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+            self.misses += 1
+            return default
+
+    def put(self, key, value, tag=None):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (tag, time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self.invalidations += len(self._entries)
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "ttl_seconds": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+            }
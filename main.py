@@ -1,13 +1,22 @@
 from fastapi import FastAPI, Request
-from fastapi.responses import HTMLResponse, RedirectResponse
+from fastapi.responses import HTMLResponse, JSONResponse, RedirectResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
-from movie_service import search_movies, get_movie_by_id, get_similar_movies, get_movie_poster_url, get_total_movies_count, get_recommendation_section
+from fastapi.concurrency import run_in_threadpool
+from movie_service import search, get_movie_by_id, get_similar_movies, get_movie_poster_url, get_recommendation_section, is_section_warming, search_cache
 from models import Movie
 import os
+import threading
 from dotenv import load_dotenv
-from overview_similarity_recommend import initialize_vectors
-from database import get_db
+import overview_similarity_recommend
+import composite_ranking_recommend
+import genre_similarity_recommend
+import token_store
+from title_index import get_title_index, load_title_index
+from movie_sampler import load_sampler
+from database import get_db, movie_table_fingerprint
+import embedding_segments
+import index_status
 
 
 # Load environment variables from .env file
@@ -19,27 +28,95 @@ app = FastAPI()
 app.mount("/static", StaticFiles(directory="static"), name="static")
 templates = Jinja2Templates(directory="templates")
 
+def load_token_store():
+    with get_db() as db:
+        store = token_store.get_store(db, movie_table_fingerprint(db))
+    return f"{len(store)} movies, {len(store.vocabulary)} tokens"
+
+def load_overview_index():
+    with get_db() as db:
+        # Check if we have movies in the database
+        movie_count = db.query(Movie).count()
+        print(f"📊 Database contains {movie_count} movies")
+        if movie_count == 0:
+            print("❌ WARNING: No movies found in database!")
+            return None
+        overview_similarity_recommend.initialize_vectors(db)
+    if overview_similarity_recommend.doc_matrix is None:
+        return None
+    return f"{len(overview_similarity_recommend.movie_ids)} overviews"
+
+def load_composite_features():
+    with get_db() as db:
+        composite_ranking_recommend.initialize_features(db)
+    if not len(composite_ranking_recommend.features):
+        return None
+    return f"{len(composite_ranking_recommend.features)} movies"
+
+def load_genre_index():
+    with get_db() as db:
+        genre_similarity_recommend.initialize_genre_index(db)
+    return f"{len(genre_similarity_recommend.genre_index)} movies"
+
+def load_embedding_index():
+    index = embedding_segments.get_index()
+    if index is None:
+        return None
+    return f"{len(index)} embeddings ({len(index.segments)} delta segments)"
+
+# Warm-up order: the title list is cheapest and serves every search request
+WARMUP_INDEXES = [
+    ("titles", load_title_index),
+    ("sampler", load_sampler),
+    ("tokens", load_token_store),
+    ("overview", load_overview_index),
+    ("composite", load_composite_features),
+    ("genres", load_genre_index),
+    ("embeddings", load_embedding_index),
+]
+
+def warm_up_indexes():
+    for name, loader in WARMUP_INDEXES:
+        index_status.warm(name, loader)
+    print("✅ Index warm-up finished")
+
 @app.on_event("startup")
 def startup_event():
-    print("🚀 SERVER STARTUP: Initializing vectors...")
-    try:
-        with get_db() as db:
-            print("✅ Database connection successful")
-            # Check if we have movies in the database
-            movie_count = db.query(Movie).count()
-            print(f"📊 Database contains {movie_count} movies")
-            
-            if movie_count == 0:
-                print("❌ WARNING: No movies found in database!")
-                return
-                
-            initialize_vectors(db)
-            print("✅ Vectors initialized successfully")
-    except Exception as e:
-        print(f"❌ ERROR during startup: {e}")
-        import traceback
-        traceback.print_exc()
+    print("🚀 SERVER STARTUP: warming up indexes in the background...")
+    for name, _ in WARMUP_INDEXES:
+        index_status.register(name)
+    threading.Thread(target=warm_up_indexes, name="index-warmup", daemon=True).start()
+
+    # Fold delta embedding segments into the base store in the background
+    embedding_segments.start_background_compaction()
+
+@app.get("/live")
+async def live():
+    """Liveness probe: the process is up and serving"""
+    return {"status": "alive"}
+
+@app.get("/ready")
+async def ready():
+    """Readiness probe: which indexes are loaded; 503 while any is still warming"""
+    is_ready = index_status.all_settled()
+    return JSONResponse(
+        status_code=200 if is_ready else 503,
+        content={"ready": is_ready, "indexes": index_status.snapshot()},
+    )
 
+
+# Most suggestions /api/suggest returns, whatever `limit` asks for
+SUGGEST_MAX_LIMIT = 20
+
+@app.get("/api/suggest")
+def suggest(q: str = "", limit: int = 8):
+    """Search-as-you-type: titles with a title or word starting with `q`, most voted first"""
+    index = get_title_index()
+    rows = index.suggest(q, max(0, min(limit, SUGGEST_MAX_LIMIT)))
+    return {
+        "query": q,
+        "suggestions": [{"id": index.movie_ids[row], "title": index.titles[row]} for row in rows],
+    }
         
 @app.get("/", response_class=HTMLResponse)
 async def root(request: Request):
@@ -58,7 +135,8 @@ async def debug_route(query: str = ""):
             "has_search_query": has_search_query,
             "is_landing": False,
             "recommendations": None,
-            "type": "search_results"
+            "type": "search_results",
+            "search_cache": search_cache.stats()
         }
     else:
         return {
@@ -66,7 +144,8 @@ async def debug_route(query: str = ""):
             "has_search_query": has_search_query,
             "is_landing": True,
             "recommendations": "6_sections",
-            "type": "landing_page"
+            "type": "landing_page",
+            "search_cache": search_cache.stats()
         }
 
 @app.get("/test", response_class=HTMLResponse)
@@ -96,8 +175,8 @@ async def search_page(request: Request, query: str = "", page: int = 1):
         if has_search_query:
             # SEARCH RESULTS: Only show search results with pagination
             print(f"🔍 Performing search for: '{query}'")
-            results = list(search_movies(query, limit=limit, page=page))
-            total_count = get_total_movies_count(query)
+            # Ranking is CPU-bound; keep it off the event loop
+            results, total_count = await run_in_threadpool(search, query, limit=limit, page=page)
             total_pages = (total_count + limit - 1) // limit
             
             print(f"📊 Search results: {len(results)} movies found, total_count={total_count}")
@@ -109,8 +188,7 @@ async def search_page(request: Request, query: str = "", page: int = 1):
         else:
             # LANDING PAGE: Show 20 random movies ONLY (no recommendation sections)
             print("🏠 Loading landing page with random movies")
-            results = list(search_movies("", limit=limit, page=page))
-            total_count = get_total_movies_count()
+            results, total_count = await run_in_threadpool(search, "", limit=limit, page=page)
             total_pages = (total_count + limit - 1) // limit
             
             print(f"📊 Landing page: {len(results)} movies loaded, total_count={total_count}")
@@ -154,6 +232,9 @@ async def film_detail(request: Request, film_id: int):
 
         print(f"✅ Found movie: {movie.get('title', 'Unknown')}")
 
+        # Sections whose index is still loading show a placeholder instead of blocking
+        warming = {section: is_section_warming(section) for section in ("algo1", "algo2", "algo3", "algo4", "algo5")}
+
         # Get 6 recommendation sections for film detail page
         print("🔍 Loading recommendation sections...")
         recommendations = {
@@ -172,7 +253,8 @@ async def film_detail(request: Request, film_id: int):
         return templates.TemplateResponse("film_detail.html", {
             "request": request,
             "film": movie,
-            "recommendations": recommendations
+            "recommendations": recommendations,
+            "warming": warming
         })
     except Exception as e:
         print(f"❌ ERROR in film_detail: {e}")
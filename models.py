@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, Text, ForeignKey, Table, JSON, DateTime, Index
+from sqlalchemy import Column, Integer, String, Float, Text, ForeignKey, Table, JSON, DateTime, Index, LargeBinary
 from sqlalchemy.orm import relationship
 from datetime import datetime
 from sqlalchemy.ext.declarative import declarative_base
@@ -14,6 +14,9 @@ movie_genre = Table(
     Column('genre_id', Integer, ForeignKey('genres.id'))
 )
 
+# Covering index for genre -> movies lookups; joins on genre_id never touch the table rows
+movie_genre_genre_movie_index = Index('idx_movie_genre_genre_movie', movie_genre.c.genre_id, movie_genre.c.movie_id)
+
 movie_actor = Table(
     'movie_actor',
     Base.metadata,
@@ -35,7 +38,7 @@ class Movie(Base):
     vote_count = Column(Integer)
     poster_path = Column(String, nullable=True)
     titlewords = Column(Text)
-    embedding_vector = Column(Text, nullable=True)  # OpenAI embedding vector as JSON string
+    embedding_vector = Column(LargeBinary, nullable=True)  # OpenAI embedding, float32 blob (see embedding_codec.py)
     
     # Relationships
     genres_rel = relationship("Genre", secondary=movie_genre, back_populates="movies")
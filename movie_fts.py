@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+SQLite FTS5 full-text index over movie titles and overviews
+
+movies_fts is an external-content FTS5 table over `movies` (content='movies'),
+so it stores only the index; triggers keep it in sync with inserts, updates
+and deletes. Matches are ranked by BM25 with the title column weighted
+FTS_TITLE_WEIGHT times the overview.
+
+    python movie_fts.py build          # create the table and triggers, index every movie
+    python movie_fts.py search <query>
+"""
+
+import os
+import re
+import sys
+import time
+from sqlalchemy import text
+from database import get_db, engine
+from models import Movie
+
+FTS_TABLE = "movies_fts"
+# BM25 weight of a title hit relative to an overview hit
+FTS_TITLE_WEIGHT = float(os.getenv("FTS_TITLE_WEIGHT", "10"))
+
+FTS_DDL = [
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+    "title, overview, content='movies', content_rowid='id', tokenize='unicode61 remove_diacritics 2')",
+    f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON movies BEGIN "
+    f"INSERT INTO {FTS_TABLE}(rowid, title, overview) VALUES (new.id, new.title, new.overview); END",
+    f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON movies BEGIN "
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, title, overview) VALUES ('delete', old.id, old.title, old.overview); END",
+    f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au AFTER UPDATE OF title, overview ON movies BEGIN "
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, title, overview) VALUES ('delete', old.id, old.title, old.overview); "
+    f"INSERT INTO {FTS_TABLE}(rowid, title, overview) VALUES (new.id, new.title, new.overview); END",
+]
+
+# Set once the table is known to exist, so search does not ask sqlite_master every time
+_fts_ready = False
+
+
+def fts_supported():
+    return engine.dialect.name == "sqlite"
+
+
+def fts_ready(db):
+    """True when movies_fts exists in this database"""
+    global _fts_ready
+    if not _fts_ready and fts_supported():
+        _fts_ready = db.execute(
+            text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"), {"name": FTS_TABLE}
+        ).first() is not None
+    return _fts_ready
+
+
+def build_fts(db):
+    """Create movies_fts and its triggers if missing, then re-index every movie"""
+    global _fts_ready
+    if not fts_supported():
+        print(f"[WARN] Full-text search needs SQLite, not {engine.dialect.name}")
+        return
+    start = time.time()
+    for statement in FTS_DDL:
+        db.execute(text(statement))
+    db.execute(text(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')"))
+    db.execute(text(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('optimize')"))
+    db.commit()
+    _fts_ready = True
+    count = db.execute(text("SELECT COUNT(*) FROM movies")).scalar()
+    print(f"[INFO] Full-text index over {count} movies built in {time.time() - start:.2f}s")
+
+
+def match_expression(query):
+    """
+    FTS5 MATCH expression for a free-text query: every word must match, the last one as a prefix
+
+    Words are quoted, so FTS5 operators and punctuation in the query are
+    taken literally. None when the query has no word characters.
+    """
+    words = re.findall(r"\w+", query.lower())
+    if not words:
+        return None
+    terms = [f'"{word}"' for word in words]
+    terms[-1] += "*"  # the user may still be typing the last word
+    return " ".join(terms)
+
+
+def search_ids(db, query, limit, offset=0):
+    """[(movie_id, bm25)] for `query`, best first (lower bm25 is better); [] if nothing matches"""
+    expression = match_expression(query)
+    if expression is None:
+        return []
+    rows = db.execute(
+        text(
+            f"SELECT rowid, bm25({FTS_TABLE}, :title_weight, 1.0) AS rank FROM {FTS_TABLE} "
+            f"WHERE {FTS_TABLE} MATCH :expression ORDER BY rank, rowid LIMIT :limit OFFSET :offset"
+        ),
+        {"title_weight": FTS_TITLE_WEIGHT, "expression": expression, "limit": limit, "offset": offset},
+    ).all()
+    return [(movie_id, rank) for movie_id, rank in rows]
+
+
+def count_matches(db, query):
+    """Number of movies matching `query`"""
+    expression = match_expression(query)
+    if expression is None:
+        return 0
+    return db.execute(
+        text(f"SELECT COUNT(*) FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH :expression"), {"expression": expression}
+    ).scalar()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "build":
+        with get_db() as db:
+            build_fts(db)
+    elif len(sys.argv) > 2 and sys.argv[1] == "search":
+        with get_db() as db:
+            hits = search_ids(db, " ".join(sys.argv[2:]), 20)
+            titles = dict(db.query(Movie.id, Movie.title).filter(Movie.id.in_([m for m, _ in hits])).all())
+        for movie_id, rank in hits:
+            print(f"{rank:8.3f}  {movie_id:>8}  {titles.get(movie_id)}")
+    else:
+        print("Usage: python movie_fts.py build | search <query>")
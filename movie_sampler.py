@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+"""
+Random movie sampling without ORDER BY random()
+
+ORDER BY random() makes SQLite sort the whole movies table for every random
+pick. MovieSampler keeps the movie ids in memory, plus the ids sorted by
+vote_average and by vote_count, so a rating range or a vote-count floor is a
+contiguous slice found by binary search. k distinct ids are drawn from a
+slice by rejection sampling, O(k) for k much smaller than the slice, and
+only those rows are then loaded by primary key.
+
+Set MOVIE_SAMPLER_SEED for reproducible draws (tests, benchmarks). The sampler
+is rebuilt when movie_table_fingerprint or movie_votes_fingerprint changes
+(the bands follow the vote columns), checked at most every
+MOVIE_SAMPLER_REFRESH_SECONDS.
+
+    python movie_sampler.py bench [num_draws]
+"""
+
+import os
+import sys
+import threading
+import time
+import numpy as np
+from sqlalchemy import func
+from database import get_db, movie_table_fingerprint, movie_votes_fingerprint
+from models import Movie
+
+MOVIE_SAMPLER_REFRESH_SECONDS = float(os.getenv("MOVIE_SAMPLER_REFRESH_SECONDS", "30"))
+MOVIE_SAMPLER_SEED = os.getenv("MOVIE_SAMPLER_SEED")
+
+_sampler = None
+_sampler_lock = threading.Lock()
+
+
+class MovieSampler:
+    def __init__(self, movie_ids, ratings, votes, fingerprint, seed=None):
+        self.movie_ids = np.asarray(movie_ids, dtype=np.int64)
+        # NULL vote_average / vote_count never match a filter on them, as in SQL
+        ratings = np.array([np.nan if r is None else r for r in ratings], dtype=np.float64)
+        votes = np.array([np.nan if v is None else v for v in votes], dtype=np.float64)
+        self.rating_ids, self.rating_values = self.sorted_band(ratings)
+        self.vote_ids, self.vote_values = self.sorted_band(votes)
+        self.fingerprint = fingerprint
+        self.checked_at = time.time()
+        self.rng = np.random.default_rng(seed)
+        self._rng_lock = threading.Lock()  # numpy generators are not thread-safe
+
+    def __len__(self):
+        return len(self.movie_ids)
+
+    def sorted_band(self, values):
+        """(ids, values) of the non-NULL values, ascending by value"""
+        rows = np.flatnonzero(~np.isnan(values))
+        order = rows[np.argsort(values[rows], kind="stable")]
+        return self.movie_ids[order], values[order]
+
+    def reseed(self, seed):
+        with self._rng_lock:
+            self.rng = np.random.default_rng(seed)
+
+    def draw(self, pool, k, exclude=None):
+        """Up to `k` distinct ids of `pool`, in random order, never `exclude`"""
+        n = len(pool)
+        want = min(k + (exclude is not None), n)  # one spare in case the excluded id is drawn
+        if k <= 0 or want <= 0:
+            return []
+        with self._rng_lock:
+            if want * 2 >= n:
+                positions = self.rng.permutation(n)[:want].tolist()
+            else:
+                chosen = {}  # insertion-ordered set of positions
+                while len(chosen) < want:
+                    for position in self.rng.integers(n, size=want - len(chosen)).tolist():
+                        chosen.setdefault(position)
+                positions = list(chosen)
+        return [movie_id for movie_id in pool[positions].tolist() if movie_id != exclude][:k]
+
+    def random(self, k, exclude=None):
+        """k random movies"""
+        return self.draw(self.movie_ids, k, exclude)
+
+    def rating_between(self, low, high, k, exclude=None):
+        """k random movies with low <= vote_average <= high"""
+        lo = np.searchsorted(self.rating_values, low, side="left")
+        hi = np.searchsorted(self.rating_values, high, side="right")
+        return self.draw(self.rating_ids[lo:hi], k, exclude)
+
+    def votes_at_least(self, minimum, k, exclude=None):
+        """k random movies with vote_count >= minimum"""
+        lo = np.searchsorted(self.vote_values, minimum, side="left")
+        return self.draw(self.vote_ids[lo:], k, exclude)
+
+
+def sampler_fingerprint(db):
+    return movie_table_fingerprint(db) + movie_votes_fingerprint(db)
+
+
+def build_sampler(db, fingerprint=None, seed=MOVIE_SAMPLER_SEED):
+    fingerprint = fingerprint or sampler_fingerprint(db)
+    rows = db.query(Movie.id, Movie.vote_average, Movie.vote_count).order_by(Movie.id).all()
+    return MovieSampler(
+        [r.id for r in rows], [r.vote_average for r in rows], [r.vote_count for r in rows], fingerprint,
+        seed=None if seed is None else int(seed),
+    )
+
+
+def get_sampler():
+    """Return the sampler, rebuilding it if the movies table changed since the last check"""
+    global _sampler
+    with _sampler_lock:
+        if _sampler is not None and time.time() - _sampler.checked_at < MOVIE_SAMPLER_REFRESH_SECONDS:
+            return _sampler
+        with get_db() as db:
+            fingerprint = sampler_fingerprint(db)
+            if _sampler is not None and _sampler.fingerprint == fingerprint:
+                _sampler.checked_at = time.time()
+            else:
+                start = time.time()
+                _sampler = build_sampler(db, fingerprint)
+                print(f"🎲 Movie sampler built: {len(_sampler)} movies in {time.time() - start:.2f}s")
+        return _sampler
+
+
+def load_sampler():
+    """Startup warm-up loader"""
+    return f"{len(get_sampler())} movies"
+
+
+def load_movies(db, movie_ids):
+    """The Movie rows of `movie_ids` by primary key, in the order given"""
+    if not movie_ids:
+        return []
+    movies = db.query(Movie).filter(Movie.id.in_(movie_ids)).all()
+    id_to_movie = {movie.id: movie for movie in movies}
+    return [id_to_movie[movie_id] for movie_id in movie_ids if movie_id in id_to_movie]
+
+
+def benchmark(num_draws=200, k=8):
+    """ORDER BY random() against the sampler, for the landing page and a rating band"""
+    sampler = get_sampler()
+    with get_db() as db:
+        timings = {}
+        start = time.time()
+        for _ in range(num_draws):
+            db.query(Movie).order_by(func.random()).limit(k).all()
+        timings["order by random()"] = time.time() - start
+        start = time.time()
+        for _ in range(num_draws):
+            load_movies(db, sampler.random(k))
+        timings["sampler"] = time.time() - start
+        start = time.time()
+        for _ in range(num_draws):
+            db.query(Movie).filter(Movie.vote_average.between(5.0, 7.0)).order_by(func.random()).limit(k).all()
+        timings["band, order by random()"] = time.time() - start
+        start = time.time()
+        for _ in range(num_draws):
+            load_movies(db, sampler.rating_between(5.0, 7.0, k))
+        timings["band, sampler"] = time.time() - start
+    print(f"[INFO] {len(sampler)} movies, {num_draws} draws of {k}")
+    for name, elapsed in timings.items():
+        print(f"[INFO] {name}: {elapsed * 1000 / num_draws:.2f} ms/draw")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "bench":
+        benchmark(int(sys.argv[2]) if len(sys.argv) > 2 else 200)
+    else:
+        print("Usage: python movie_sampler.py bench [num_draws]")
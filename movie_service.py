@@ -1,13 +1,17 @@
 from models import Movie
 from database import get_db
-from sqlalchemy import or_, func
+from sqlalchemy import or_
 import requests
 import os
 from PIL import Image
 from io import BytesIO
-from rapidfuzz import process, fuzz
 import random
 import title_overlap_recommend, genre_similarity_recommend, overview_similarity_recommend, composite_ranking_recommend, embedding_similarity_recommend
+import index_status
+import movie_fts
+from title_index import get_title_index
+from lru_ttl_cache import LRUTTLCache
+from movie_sampler import get_sampler, load_movies
 from dotenv import load_dotenv
 
 # Load environment variables
@@ -16,19 +20,38 @@ TMDB_API_KEY = os.getenv("TMDB_API_KEY")
 
 TMDB_IMAGE_BASE_URL = "https://image.tmdb.org/t/p/w500"
 
-def _get_movie_titles():
-    """Get cached movie titles for fuzzy search"""
-    with get_db() as db:
-        movies = db.query(Movie.id, Movie.title).all()
-        # Filter out None titles to prevent errors
-        return [(m.id, m.title) for m in movies if m.title is not None]
+# Recommendation sections that depend on an index warmed up after startup
+SECTION_INDEXES = {
+    "algo1": "overview",
+    "algo2": "composite",
+    "algo3": "tokens",
+    "algo4": "genres",
+    "algo5": "embeddings",
+}
+
+# Fuzzy title matches considered per query; pages and total count come from the same list
+SEARCH_FUZZY_LIMIT = int(os.getenv("SEARCH_FUZZY_LIMIT", "100"))
+# Full-text hits held per query (later pages are read from the index), and the fewest
+# before fuzzy title matches are added
+SEARCH_FTS_LIMIT = int(os.getenv("SEARCH_FTS_LIMIT", "1000"))
+SEARCH_FTS_MIN_HITS = int(os.getenv("SEARCH_FTS_MIN_HITS", "8"))
+# Ranked match lists held for recent queries, so paging is a slice
+SEARCH_RESULT_CACHE_SIZE = int(os.getenv("SEARCH_RESULT_CACHE_SIZE", "256"))
+SEARCH_RESULT_CACHE_TTL = float(os.getenv("SEARCH_RESULT_CACHE_TTL", "600"))
+# normalized query -> (ranked matches, total), tagged with the movie table fingerprint they were ranked at
+search_cache = LRUTTLCache(SEARCH_RESULT_CACHE_SIZE, SEARCH_RESULT_CACHE_TTL)
+
+def is_section_warming(section_name: str):
+    """True while the index behind a recommendation section is still being built"""
+    index_name = SECTION_INDEXES.get(section_name)
+    return index_name is not None and index_status.is_warming(index_name)
 
 def _get_cached_recommendations(section_name: str, film_id, limit: int = 6):
     """Get recommendations for a section without caching"""
     with get_db() as db:
         if section_name == "random":
             # Simple random selection - no complex filtering
-            random_movies = db.query(Movie).order_by(func.random()).limit(limit).all()
+            random_movies = load_movies(db, get_sampler().random(limit))
                 
         elif section_name == "algo1":
             # Algorithm 1: High-rated movies (simplified)
@@ -61,7 +84,7 @@ def _get_cached_recommendations(section_name: str, film_id, limit: int = 6):
 
         else:
             # Default to random
-            random_movies = db.query(Movie).order_by(func.random()).limit(limit).all()
+            random_movies = load_movies(db, get_sampler().random(limit))
 
         #if no recommendations
         if not random_movies:
@@ -77,7 +100,12 @@ def _get_cached_recommendations(section_name: str, film_id, limit: int = 6):
         return results
 
 def get_recommendation_section(section_name: str, film_id: int = 158, limit: int = 6):
-    """Get movies for different recommendation sections - no caching."""
+    """Get movies for different recommendation sections - no caching.
+
+    Returns an empty list while the section's index is warming instead of blocking on it.
+    """
+    if is_section_warming(section_name):
+        return []
     return _get_cached_recommendations(section_name, film_id, limit)
 
 def get_movie_poster_url(movie_id, poster_path):
@@ -141,108 +169,123 @@ def get_movie_poster_url(movie_id, poster_path):
     # Final fallback to default poster
     return "/static/posters/default.jpg"
 
-def _get_cached_search_results(query: str, limit: int, page: int):
-    """Get search results without caching"""
+def normalize_query(query: str):
+    """Cache key and ranking input for a search query: lower-cased, whitespace collapsed"""
+    return " ".join(query.lower().split())
+
+def _search_title_matches(query: str, index, db):
+    """
+    Rank matches for a normalized query: ([(movie_id, score, type)] best first, total)
+
+    With the full-text index built, BM25 hits over titles and overviews come
+    first (score = -bm25), and fuzzy title matches follow only when there are
+    fewer than SEARCH_FTS_MIN_HITS of them, to catch typos. At most
+    SEARCH_FTS_LIMIT hits are held; the total still counts every match.
+    Without the index, case-insensitive title substring matches (score 100)
+    and fuzzy matches are sorted together by score, then title.
+    """
+    if movie_fts.fts_ready(db):
+        ranked = _fts_matches(db, query, SEARCH_FTS_LIMIT)
+        if len(ranked) >= SEARCH_FTS_MIN_HITS:
+            total = movie_fts.count_matches(db, query) if len(ranked) == SEARCH_FTS_LIMIT else len(ranked)
+            return ranked, total
+        seen = {movie_id for movie_id, _, _ in ranked}
+        fuzzy = []
+        for i, score in index.fuzzy_matches(query, SEARCH_FUZZY_LIMIT):
+            movie_id = index.title_to_id[index.titles[i]]
+            if movie_id not in seen:
+                seen.add(movie_id)
+                fuzzy.append((movie_id, score, 'fuzzy', index.normalized[i]))
+        fuzzy.sort(key=lambda match: (-match[1], match[3]))
+        ranked += [(movie_id, score, match_type) for movie_id, score, match_type, _ in fuzzy]
+        return ranked, len(ranked)
+
+    all_movies = {}
+
+    # Strategy 1: Exact title matches (case-insensitive substring)
+    for i in index.substring_matches(query):
+        all_movies[index.movie_ids[i]] = (100, 'exact', index.normalized[i])
+
+    # Strategy 2: Fuzzy search on the titles sharing the most trigrams with the query
+    for i, score in index.fuzzy_matches(query, SEARCH_FUZZY_LIMIT):
+        movie_id = index.title_to_id[index.titles[i]]
+        if movie_id not in all_movies:
+            all_movies[movie_id] = (score, 'fuzzy', index.normalized[i])
+
+    # Sort by score (highest first) and then by title
+    ranked = sorted(all_movies.items(), key=lambda item: (-item[1][0], item[1][2]))
+    ranked = [(movie_id, score, match_type) for movie_id, (score, match_type, _) in ranked]
+    return ranked, len(ranked)
+
+def _fts_matches(db, query: str, limit: int, offset: int = 0):
+    """Full-text hits as ranked matches"""
+    return [(movie_id, round(-rank, 2), 'fts') for movie_id, rank in movie_fts.search_ids(db, query, limit, offset)]
+
+def _ranked_matches(query: str, db):
+    """(ranked matches, total) for a query, served from search_cache until the movie table changes"""
+    key = normalize_query(query)
+    index = get_title_index()
+    # Results also change once the full-text index gets built
+    tag = (index.fingerprint, movie_fts.fts_ready(db))
+    entry = search_cache.get(key, tag)
+    if entry is None:
+        entry = _search_title_matches(key, index, db)
+        search_cache.put(key, entry, tag)
+    return entry
+
+def search(query: str, limit: int = 20, page: int = 1):
+    """
+    One search pass: (results for the page, total number of results)
+
+    Later pages of the same query slice the held ranked list; pages past
+    the held full-text hits are read from the full-text index.
+    """
     offset = (page - 1) * limit
-    
+
     with get_db() as db:
-        if not query:
+        if not normalize_query(query):
             # Simple random selection for landing page
-            random_movies = db.query(Movie).order_by(func.random()).limit(limit).all()
+            random_movies = load_movies(db, get_sampler().random(limit))
             
             results = []
             for movie in random_movies:
                 movie_dict = movie.to_dict()
                 movie_dict['poster_url'] = get_movie_poster_url(movie.id, movie.poster_path)
                 results.append(movie_dict)
-            return results
+            return results, db.query(Movie).count()
+
+        ranked, total = _ranked_matches(query, db)
+        # Apply pagination before touching the database: only the page's rows are loaded
+        if offset + limit > len(ranked) and total > len(ranked):
+            page_matches = _fts_matches(db, normalize_query(query), limit, offset)
         else:
-            # Simplified search: exact + fuzzy matching only
-            
-            # Strategy 1: Exact title matches (case-insensitive)
-            exact_matches = db.query(Movie).filter(
-                Movie.title.ilike(f"%{query}%")
-            ).all()
-            
-            # Strategy 2: Fuzzy search on titles (case-insensitive)
-            movie_titles = _get_movie_titles()
-            titles = [title for _, title in movie_titles if title is not None]  # Filter out None values
-            
-            # Use case-insensitive fuzzy search
-            fuzzy_matches = process.extract(query.lower(), [title.lower() for title in titles], scorer=fuzz.WRatio, limit=30)
-            fuzzy_titles = [titles[match[2]] for match in fuzzy_matches if match[1] > 50]
-            
-            # Combine results with simple deduplication
-            all_movies = {}
-            
-            # Add exact matches first (highest priority)
-            for movie in exact_matches:
-                all_movies[movie.id] = {'movie': movie, 'score': 100, 'type': 'exact'}
-            
-            # Add fuzzy matches (avoid duplicates)
-            for title in fuzzy_titles:
-                movie = db.query(Movie).filter(Movie.title == title).first()
-                if movie and movie.id not in all_movies:
-                    # Find the fuzzy match score
-                    for match in fuzzy_matches:
-                        if titles[match[2]] == title:
-                            all_movies[movie.id] = {'movie': movie, 'score': match[1], 'type': 'fuzzy'}
-                            break
-            
-            # Sort by score (highest first) and then by title
-            sorted_movies = sorted(
-                all_movies.values(), 
-                key=lambda x: (-x['score'], x['movie'].title.lower())
-            )
-            
-            # Apply pagination
-            paginated_movies = sorted_movies[offset:offset + limit]
-            
-            # Return results
-            results = []
-            for item in paginated_movies:
-                movie = item['movie']
-                movie_dict = movie.to_dict()
-                movie_dict['poster_url'] = get_movie_poster_url(movie.id, movie.poster_path)
-                movie_dict['search_score'] = item['score']
-                movie_dict['search_type'] = item['type']
-                results.append(movie_dict)
-            return results
+            page_matches = ranked[offset:offset + limit]
+        movies = db.query(Movie).filter(Movie.id.in_([movie_id for movie_id, _, _ in page_matches])).all()
+        id_to_movie = {movie.id: movie for movie in movies}
+
+        # Return results
+        results = []
+        for movie_id, score, match_type in page_matches:
+            movie = id_to_movie.get(movie_id)
+            if movie is None:
+                continue
+            movie_dict = movie.to_dict()
+            movie_dict['poster_url'] = get_movie_poster_url(movie.id, movie.poster_path)
+            movie_dict['search_score'] = score
+            movie_dict['search_type'] = match_type
+            results.append(movie_dict)
+        return results, total
 
 def search_movies(query: str, limit: int = 20, page: int = 1):
-    """Simplified search with case-insensitive fuzzy and exact matching - no caching"""
-    return _get_cached_search_results(query, limit, page)
+    """Search results for one page (see search() to get the total as well)"""
+    return search(query, limit, page)[0]
 
 def get_total_movies_count(query: str = ""):
-    """Get total count of movies for pagination - simplified."""
+    """Total number of search results for a query, or of movies for the landing page"""
     with get_db() as db:
-        if not query:
-            # Simple count for landing page
-            count = db.query(Movie).count()
-            return count
-        else:
-            # Simplified count: exact + fuzzy matches only
-            movie_ids = set()
-            
-            # Exact title matches
-            exact_matches = db.query(Movie.id).filter(
-                Movie.title.ilike(f"%{query}%")
-            ).all()
-            movie_ids.update([m.id for m in exact_matches])
-            
-            # Fuzzy search matches (case-insensitive)
-            movie_titles = _get_movie_titles()
-            titles = [title for _, title in movie_titles if title is not None]  # Filter out None values
-            fuzzy_matches = process.extract(query.lower(), [title.lower() for title in titles], scorer=fuzz.WRatio, limit=100)
-            fuzzy_titles = [titles[match[2]] for match in fuzzy_matches if match[1] > 50]
-            
-            for title in fuzzy_titles:
-                movie = db.query(Movie.id).filter(Movie.title == title).first()
-                if movie:
-                    movie_ids.add(movie.id)
-            
-            count = len(movie_ids)
-            return count
+        if not normalize_query(query):
+            return db.query(Movie).count()
+        return _ranked_matches(query, db)[1]
 
 def get_movie_by_id(movie_id: int):
     """Get a movie by its ID."""
@@ -263,28 +306,24 @@ def get_similar_movies(movie_id: int, limit: int = 6):
         if not movie:
             return []
         
-        # Try to find similar movies using multiple criteria
-        similar_movies = []
+        # Try to find similar movies using multiple criteria, sampled in memory
+        sampler = get_sampler()
+        similar_ids = []
         
         # First try: movies with similar vote average (within 1.0 range)
         if movie.vote_average:
-            similar_movies = db.query(Movie).filter(
-                Movie.id != movie_id,
-                Movie.vote_average.between(movie.vote_average - 1.0, movie.vote_average + 1.0)
-            ).order_by(func.random()).limit(limit).all()
+            similar_ids = sampler.rating_between(movie.vote_average - 1.0, movie.vote_average + 1.0, limit, exclude=movie_id)
         
         # Second try: if no results, get random movies with similar vote count
-        if not similar_movies and movie.vote_count:
-            similar_movies = db.query(Movie).filter(
-                Movie.id != movie_id,
-                Movie.vote_count >= movie.vote_count * 0.5
-            ).order_by(func.random()).limit(limit).all()
+        if not similar_ids and movie.vote_count:
+            similar_ids = sampler.votes_at_least(movie.vote_count * 0.5, limit, exclude=movie_id)
         
         # Third try: if still no results, get random movies
-        if not similar_movies:
-            similar_movies = db.query(Movie).filter(
-                Movie.id != movie_id
-            ).order_by(func.random()).limit(limit).all()
+        if not similar_ids:
+            similar_ids = sampler.random(limit, exclude=movie_id)
+
+        # Only the sampled rows are loaded, by primary key
+        similar_movies = load_movies(db, similar_ids)
         
         # Add poster URLs to the results
         results = []
@@ -0,0 +1,180 @@
+"""
+Term -> postings inverted index over the overview TF-IDF weights, with MaxScore top-k
+
+Query terms are processed in decreasing order of their score upper bound
+(query weight x largest document weight). While an unseen document could
+still reach the current k-th best score, a term's postings add new
+candidates. After that, the remaining terms only update the candidates
+already found, and candidates whose score plus the remaining upper bound
+cannot reach the threshold are dropped. Results are exact. Scores go into a
+reusable per-thread accumulator that is reset only where it was touched, so
+the work done depends on how selective the query terms are, not on catalog
+size.
+
+    python overview_inverted_index.py bench [num_queries] [k]
+"""
+
+import threading
+import time
+import numpy as np
+
+
+class InvertedIndex:
+    """Postings lists (doc rows ascending, TF-IDF weights) for every term of a docs x terms CSR"""
+
+    def __init__(self, doc_matrix):
+        csc = doc_matrix.tocsc()
+        csc.sort_indices()
+        self.num_docs = doc_matrix.shape[0]
+        self.offsets = csc.indptr.astype(np.int64)
+        self.doc_rows = csc.indices.astype(np.int64)
+        self.weights = csc.data.astype(np.float32)
+
+        # Largest weight in every postings list: the per-term score upper bound
+        self.max_weight = np.zeros(doc_matrix.shape[1], dtype=np.float32)
+        lengths = np.diff(self.offsets)
+        non_empty = np.flatnonzero(lengths)
+        if len(non_empty):
+            self.max_weight[non_empty] = np.maximum.reduceat(self.weights, self.offsets[non_empty])
+        self._local = threading.local()
+
+    @property
+    def nbytes(self):
+        return self.offsets.nbytes + self.doc_rows.nbytes + self.weights.nbytes + self.max_weight.nbytes
+
+    def postings(self, term_id):
+        start, end = self.offsets[term_id], self.offsets[term_id + 1]
+        return self.doc_rows[start:end], self.weights[start:end]
+
+    def scratch(self):
+        """Per-thread score accumulator and seen-mask, reset after every query"""
+        if getattr(self._local, "scores", None) is None:
+            self._local.scores = np.zeros(self.num_docs, dtype=np.float32)
+            self._local.seen = np.zeros(self.num_docs, dtype=bool)
+        return self._local.scores, self._local.seen
+
+    def top_k(self, query_terms, query_weights, k, exclude_row=None, stats=None):
+        """
+        Exact top-k doc rows by dot product with a sparse query, best first
+
+        Returns (rows, scores). Only documents sharing at least one term with the
+        query are returned. If `stats` is a dict it receives the number of
+        postings scanned.
+        """
+        if k <= 0 or len(query_terms) == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        query_terms = np.asarray(query_terms, dtype=np.int64)
+        query_weights = np.asarray(query_weights, dtype=np.float32)
+        upper_bounds = query_weights * self.max_weight[query_terms]
+        order = np.argsort(-upper_bounds, kind="stable")
+        query_terms, query_weights, upper_bounds = query_terms[order], query_weights[order], upper_bounds[order]
+        # remaining[i]: best score a document can still gain from terms i..end
+        remaining = np.concatenate([np.cumsum(upper_bounds[::-1])[::-1], [0.0]])
+
+        scores, seen = self.scratch()
+        touched = []
+        if exclude_row is not None:
+            seen[exclude_row] = True  # never becomes a candidate
+            touched.append(np.array([exclude_row], dtype=np.int64))
+        candidates = np.empty(0, dtype=np.int64)
+        threshold = -np.inf
+        essential = True
+        scanned = 0
+
+        try:
+            for i, (term_id, q_weight) in enumerate(zip(query_terms, query_weights)):
+                if upper_bounds[i] <= 0:
+                    break
+                rows, weights = self.postings(term_id)
+
+                if essential and remaining[i] < threshold:
+                    # From here on no unseen document can reach the top k
+                    essential = False
+                    candidates.sort()
+
+                if essential:
+                    scanned += len(rows)
+                    scores[rows] += q_weight * weights
+                    new_rows = rows[~seen[rows]]
+                    seen[new_rows] = True
+                    touched.append(new_rows)
+                    candidates = np.concatenate([candidates, new_rows])
+                elif len(candidates) * 16 < len(rows):
+                    # Few candidates, long list: binary-search the candidates in the postings
+                    scanned += len(candidates)
+                    pos = np.minimum(np.searchsorted(rows, candidates), len(rows) - 1)
+                    hit = rows[pos] == candidates
+                    scores[candidates[hit]] += q_weight * weights[pos[hit]]
+                else:
+                    scanned += len(rows)
+                    mask = seen[rows]
+                    scores[rows[mask]] += q_weight * weights[mask]
+
+                if len(candidates) >= k:
+                    candidate_scores = scores[candidates]
+                    threshold = np.partition(candidate_scores, len(candidates) - k)[len(candidates) - k]
+                    if not essential:
+                        candidates = candidates[candidate_scores + remaining[i + 1] >= threshold]
+
+            k = min(k, len(candidates))
+            candidate_scores = scores[candidates]
+            best = np.argpartition(-candidate_scores, k - 1)[:k] if k > 0 else np.empty(0, dtype=np.int64)
+            best = best[np.argsort(-candidate_scores[best], kind="stable")]
+            if stats is not None:
+                stats["postings_scanned"] = scanned
+            return candidates[best], candidate_scores[best]
+        finally:
+            for rows in touched:
+                scores[rows] = 0.0
+                seen[rows] = False
+
+
+def benchmark(num_queries=200, k=10, seed=0):
+    """Compare MaxScore against the full sparse matrix-vector product on random seed overviews"""
+    import overview_similarity_recommend as overview
+    from database import get_db
+
+    with get_db() as db:
+        overview.initialize_vectors(db)
+    if overview.doc_matrix is None:
+        print("No overview index available.")
+        return
+    index = overview.get_inverted_index()
+
+    rng = np.random.default_rng(seed)
+    rows = rng.choice(overview.doc_matrix.shape[0], min(num_queries, overview.doc_matrix.shape[0]), replace=False)
+    matrix_time = maxscore_time = 0.0
+    mismatches = scanned = 0
+    for row in rows:
+        query = overview.doc_matrix.getrow(row)
+        terms, weights = query.indices, query.data
+
+        start = time.time()
+        sims = overview.doc_matrix @ query.toarray().ravel()
+        exact = overview.top_k(sims, k, exclude=row)
+        exact = exact[sims[exact] > 0]
+        matrix_time += time.time() - start
+
+        stats = {}
+        start = time.time()
+        found, scores = index.top_k(terms, weights, k, exclude_row=row, stats=stats)
+        maxscore_time += time.time() - start
+        scanned += stats["postings_scanned"]
+        if not np.allclose(np.sort(sims[exact]), np.sort(scores), atol=1e-5):
+            mismatches += 1
+
+    n = len(rows)
+    print(f"[INFO] {n} queries, k={k}, {overview.doc_matrix.shape[0]} docs, "
+          f"inverted index {index.nbytes / 1e6:.1f} MB")
+    print(f"[INFO] matrix product: {matrix_time / n * 1000:.2f} ms/query")
+    print(f"[INFO] MaxScore      : {maxscore_time / n * 1000:.2f} ms/query, "
+          f"{scanned / n:.0f} postings scanned/query, {mismatches} score mismatches")
+
+
+if __name__ == "__main__":
+    import sys
+
+    if len(sys.argv) > 1 and sys.argv[1] == "bench":
+        benchmark(int(sys.argv[2]) if len(sys.argv) > 2 else 200, int(sys.argv[3]) if len(sys.argv) > 3 else 10)
+    else:
+        print("Usage: python overview_inverted_index.py bench [num_queries] [k]")
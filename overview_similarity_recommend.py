@@ -1,51 +1,212 @@
+import os
+import shutil
 import time
 from sqlalchemy.orm import joinedload
 from models import Movie
-from database import get_db
+from database import get_db, movie_table_fingerprint
+from overview_inverted_index import InvertedIndex
+import token_store
 
-from gensim.corpora import Dictionary
+from gensim.matutils import corpus2csc
 from gensim.models import TfidfModel
-from gensim.similarities import MatrixSimilarity
-from gensim.utils import simple_preprocess
 import numpy as np
+from scipy import sparse
+
+# Offline artifacts, one subdirectory per movie-table fingerprint
+OVERVIEW_INDEX_DIR = os.getenv("OVERVIEW_INDEX_DIR", "overview_index")
+# "maxscore": pruned top-k over the inverted index; "matrix": full sparse matrix-vector product
+OVERVIEW_SEARCH_MODE = os.getenv("OVERVIEW_SEARCH_MODE", "maxscore")
 
 # Global storage
-corpus = []
-movie_ids = []
-dictionary = None
+movie_ids = np.empty(0, dtype=np.int64)  # sorted; row i of doc_matrix is movie_ids[i]
 tfidf_model = None
-similarity_index = None
+doc_matrix = None  # CSR docs x terms (term = token_store vocabulary id), unit-length TF-IDF rows
+inverted_index = None  # term -> postings view of doc_matrix, built on demand
+loaded_fingerprint = None
 
 
-def preprocess(text):
-    return simple_preprocess(text, deacc=True)
+def initialize_vectors(db):
+    """Load the overview index for the current movie table, rebuilding only when it changed"""
+    fingerprint = movie_table_fingerprint(db)
+    if fingerprint == loaded_fingerprint:
+        return
+    store = token_store.get_store(db, fingerprint)
+    if load_artifacts(fingerprint, store.vocabulary):
+        print(f"Overview vectors loaded from {artifact_dir(fingerprint)}/")
+    else:
+        print("No overview artifacts for the current movie table, rebuilding...")
+        build_vectors(db, fingerprint)
+        save_artifacts(fingerprint, store.vocabulary)
+    if OVERVIEW_SEARCH_MODE == "maxscore":
+        get_inverted_index()
+
+
+def get_inverted_index():
+    """Return the postings index for the current doc_matrix, building it on first use"""
+    global inverted_index
+    if doc_matrix is None:
+        return None
+    if inverted_index is None or inverted_index.num_docs != doc_matrix.shape[0]:
+        start = time.time()
+        inverted_index = InvertedIndex(doc_matrix)
+        print(f"[INFO] Overview inverted index built in {time.time() - start:.2f}s "
+              f"({inverted_index.nbytes / 1e6:.1f} MB)")
+    return inverted_index
 
 
-def initialize_vectors(db):
-    global corpus, movie_ids, dictionary, tfidf_model, similarity_index
+def build_vectors(db, fingerprint=None):
+    global movie_ids, tfidf_model, doc_matrix, inverted_index
 
     print("Initializing overview vectors...")
-    movies = db.query(Movie)\
+    start = time.time()
+    store = token_store.get_store(db, fingerprint)
+    ids = db.query(Movie.id)\
         .filter(Movie.overview.isnot(None), Movie.overview != "")\
-        .limit(40000)\
+        .order_by(Movie.id)\
         .all()
 
-    if not movies:
+    if not ids:
         print("No movies with overviews found.")
         return
 
-    documents = [preprocess(movie.overview) for movie in movies]
-    movie_ids[:] = [movie.id for movie in movies]
-
-    dictionary = Dictionary(documents)
-    bow_corpus = [dictionary.doc2bow(doc) for doc in documents]
+    # Bag-of-words counts straight from the stored token ids, no re-tokenizing
+    movie_ids = np.array([movie_id for movie_id, in ids], dtype=np.int64)
+    counts = store.overview_matrix(movie_ids)
+    bow_corpus = [
+        list(zip(counts.indices[start:end].tolist(), counts.data[start:end].tolist()))
+        for start, end in zip(counts.indptr[:-1], counts.indptr[1:])
+    ]
     tfidf_model = TfidfModel(bow_corpus)
-    tfidf_corpus = tfidf_model[bow_corpus]
 
-    similarity_index = MatrixSimilarity(tfidf_corpus, num_features=len(dictionary))
-    corpus[:] = tfidf_corpus
+    # terms x docs CSC from gensim, transposed to docs x terms CSR for row-wise dot products
+    inverted_index = None
+    doc_matrix = corpus2csc(
+        tfidf_model[bow_corpus], num_terms=counts.shape[1], num_docs=len(bow_corpus), dtype=np.float32
+    ).T.tocsr()
+
+    print(f"Overview vector initialization complete: {len(movie_ids)} movies in {time.time() - start:.1f}s")
+    report_memory()
+
+
+def report_memory():
+    """Print the resident size of the sparse index next to what a dense matrix would need"""
+    if doc_matrix is None:
+        return
+    sparse_mb = (doc_matrix.data.nbytes + doc_matrix.indices.nbytes + doc_matrix.indptr.nbytes) / 1e6
+    dense_mb = doc_matrix.shape[0] * doc_matrix.shape[1] * 4 / 1e6
+    print(f"[INFO] Overview index: {doc_matrix.shape[0]} docs x {doc_matrix.shape[1]} terms, "
+          f"{doc_matrix.nnz} non-zeros, {sparse_mb:.1f} MB sparse (dense float32 would be {dense_mb:.1f} MB)")
+
 
-    print("Overview vector initialization complete.")
+def artifact_dir(fingerprint):
+    return os.path.join(OVERVIEW_INDEX_DIR, fingerprint)
+
+
+def save_artifacts(fingerprint, vocabulary):
+    """Persist TF-IDF model and similarity index, replacing older fingerprints"""
+    global loaded_fingerprint
+    if doc_matrix is None:
+        return
+    target = artifact_dir(fingerprint)
+    tmp = target + ".tmp"
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+
+    tfidf_model.save(os.path.join(tmp, "tfidf.gensim"))
+    np.save(os.path.join(tmp, "movie_ids.npy"), movie_ids)
+    np.save(os.path.join(tmp, "doc_shape.npy"), np.array(doc_matrix.shape, dtype=np.int64))
+    np.save(os.path.join(tmp, "vocabulary_crc.npy"), np.array(vocabulary.checksum(doc_matrix.shape[1]), dtype=np.int64))
+    for part in ("data", "indices", "indptr"):
+        np.save(os.path.join(tmp, f"doc_{part}.npy"), getattr(doc_matrix, part))
+
+    shutil.rmtree(target, ignore_errors=True)
+    os.replace(tmp, target)
+    for name in os.listdir(OVERVIEW_INDEX_DIR):
+        if name != fingerprint:
+            shutil.rmtree(os.path.join(OVERVIEW_INDEX_DIR, name), ignore_errors=True)
+    loaded_fingerprint = fingerprint
+    print(f"Overview artifacts saved to {target}/")
+
+
+def load_artifacts(fingerprint, vocabulary):
+    """
+    Load saved artifacts for this fingerprint (sparse matrix memory-mapped)
+
+    Returns False if they are missing or were built over different token ids.
+    """
+    global movie_ids, tfidf_model, doc_matrix, inverted_index, loaded_fingerprint
+    target = artifact_dir(fingerprint)
+    if not os.path.isdir(target):
+        return False
+    try:
+        loaded_tfidf = TfidfModel.load(os.path.join(target, "tfidf.gensim"))
+        loaded_ids = np.load(os.path.join(target, "movie_ids.npy"))
+        shape = tuple(np.load(os.path.join(target, "doc_shape.npy")).tolist())
+        if int(np.load(os.path.join(target, "vocabulary_crc.npy"))) != vocabulary.checksum(shape[1]):
+            print(f"Overview artifacts in {target}/ use another token vocabulary, ignoring them")
+            return False
+        data, indices, indptr = (
+            np.load(os.path.join(target, f"doc_{part}.npy"), mmap_mode="r")
+            for part in ("data", "indices", "indptr")
+        )
+        loaded_matrix = sparse.csr_matrix(
+            (data, indices, indptr), shape=shape, copy=False
+        )
+    except Exception as e:
+        print(f"Could not load overview artifacts from {target}/: {e}")
+        return False
+
+    tfidf_model, doc_matrix, movie_ids = loaded_tfidf, loaded_matrix, loaded_ids
+    inverted_index = None
+    loaded_fingerprint = fingerprint
+    report_memory()
+    return True
+
+
+def top_k(scores, k, exclude=None):
+    """Indices of the k highest scores, best first, via partial sort instead of a full argsort"""
+    if exclude is not None:
+        scores[exclude] = -np.inf
+    k = min(k, len(scores) - (exclude is not None))  # the excluded row never makes the cut
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    candidates = np.argpartition(-scores, k - 1)[:k]
+    return candidates[np.argsort(-scores[candidates], kind="stable")]
+
+
+def query_terms(token_ids):
+    """Sparse TF-IDF vector of overview token ids: (term ids, weights)"""
+    token_ids = np.asarray(token_ids, dtype=np.int64)
+    terms, counts = np.unique(token_ids[token_ids < doc_matrix.shape[1]], return_counts=True)
+    pairs = tfidf_model[list(zip(terms.tolist(), counts.tolist()))]
+    terms = np.array([term_id for term_id, _ in pairs], dtype=np.int64)
+    weights = np.array([weight for _, weight in pairs], dtype=np.float32)
+    return terms, weights
+
+
+def query_vector(token_ids):
+    """Dense TF-IDF vector of overview token ids over the index vocabulary"""
+    query = np.zeros(doc_matrix.shape[1], dtype=np.float32)
+    terms, weights = query_terms(token_ids)
+    query[terms] = weights
+    return query
+
+
+def row_of(movie_id):
+    row = int(np.searchsorted(movie_ids, movie_id))
+    if row < len(movie_ids) and movie_ids[row] == movie_id:
+        return row
+    return None
+
+
+def build_artifacts():
+    """Offline build: python overview_similarity_recommend.py build"""
+    start = time.time()
+    with get_db() as db:
+        fingerprint = movie_table_fingerprint(db)
+        build_vectors(db, fingerprint)
+        save_artifacts(fingerprint, token_store.get_store(db, fingerprint).vocabulary)
+    print(f"[INFO] Overview artifacts built in {time.time() - start:.1f} seconds")
 
 
 def get_movie_by_id(movie_id, db):
@@ -55,10 +216,9 @@ def get_movie_by_id(movie_id, db):
         .filter(Movie.id == movie_id)
         .first()
     )
-def recommend(movie_id: int, limit: int, db):
-    global dictionary, tfidf_model, similarity_index, movie_ids
 
-    if similarity_index is None:
+def recommend(movie_id: int, limit: int, db):
+    if doc_matrix is None:
         initialize_vectors(db)
 
     base_movie = get_movie_by_id(movie_id, db)
@@ -71,19 +231,14 @@ def recommend(movie_id: int, limit: int, db):
 
     total_start_time = time.time()
 
-    query_bow = dictionary.doc2bow(preprocess(base_movie.overview))
-    query_tfidf = tfidf_model[query_bow]
-
-    sims = similarity_index[query_tfidf]
-    ranked_indices = np.argsort(sims)[::-1]
-
-    recommended_ids = []
-    for idx in ranked_indices:
-        candidate_id = movie_ids[idx]
-        if candidate_id != movie_id:
-            recommended_ids.append(candidate_id)
-        if len(recommended_ids) >= limit:
-            break
+    token_ids = token_store.get_store(db).movie_overview_ids(movie_id, base_movie.overview)
+    if OVERVIEW_SEARCH_MODE == "maxscore":
+        terms, weights = query_terms(token_ids)
+        rows, _ = get_inverted_index().top_k(terms, weights, limit, exclude_row=row_of(movie_id))
+    else:
+        sims = doc_matrix @ query_vector(token_ids)
+        rows = top_k(sims, limit, exclude=row_of(movie_id))
+    recommended_ids = movie_ids[rows].tolist()
 
     if not recommended_ids:
         print("No recommendations found.")
@@ -134,4 +289,9 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
+    import sys
+
+    if len(sys.argv) > 1 and sys.argv[1] == "build":
+        build_artifacts()
+    else:
+        main()
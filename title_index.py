@@ -0,0 +1,321 @@
+"""
+Process-wide title index for search
+
+Holds every movie's id, original title and lower-cased title, plus a
+title -> id map, so search requests never re-read or re-normalize the title
+column. The index is rebuilt when movie_table_fingerprint changes, and its
+vote counts are re-read when movie_votes_fingerprint changes; both are
+checked at most every TITLE_INDEX_REFRESH_SECONDS.
+
+Fuzzy matching can be prefiltered by a character-trigram inverted index: with
+TITLE_TRIGRAM_BUDGET set, WRatio only runs on that many titles sharing the most
+trigrams with the query. `recall` reports what that loses against the full scan:
+
+    python title_index.py recall [num_queries] [budget ...]
+    python title_index.py bench [num_queries]
+
+Search-as-you-type suggestions come from a sorted list of prefix keys (each
+normalized title and each of its later words), searched with bisect and
+ranked by vote_count:
+
+    python title_index.py suggest-bench [num_queries]
+"""
+
+import os
+import sys
+import threading
+import time
+from bisect import bisect_left
+import numpy as np
+from rapidfuzz import process, fuzz
+from database import get_db, movie_table_fingerprint, movie_votes_fingerprint
+from models import Movie
+
+TITLE_INDEX_REFRESH_SECONDS = float(os.getenv("TITLE_INDEX_REFRESH_SECONDS", "30"))
+# Titles WRatio scores per query, picked by shared trigrams (0 = score every title).
+# Off by default so results match the full WRatio scan exactly; set it (e.g. 5000)
+# once `python title_index.py recall` shows the loss is acceptable for the catalog.
+TITLE_TRIGRAM_BUDGET = int(os.getenv("TITLE_TRIGRAM_BUDGET", "0"))
+# Fuzzy matches must score above this (WRatio, 0-100)
+FUZZY_MIN_SCORE = 50
+# Threads rapidfuzz scores the candidates on (-1 = every core)
+TITLE_FUZZY_WORKERS = int(os.getenv("TITLE_FUZZY_WORKERS", "1"))
+# Prefix matches ranked exactly per suggestion; larger ranges keep only the most voted first
+SUGGEST_RANK_POOL = 8
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def trigrams(text):
+    """Character trigrams of a normalized title or query, padded so word starts and ends count"""
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class TitleIndex:
+    def __init__(self, movie_ids, titles, fingerprint, votes=None):
+        self.movie_ids = movie_ids  # ascending
+        self.titles = titles
+        self.votes = np.zeros(len(titles), dtype=np.int64) if votes is None else np.asarray(votes, dtype=np.int64)
+        self.votes_fingerprint = None
+        self.normalized = [title.lower() for title in titles]
+        # First (lowest) id per exact title, like Movie.title == title .first()
+        self.title_to_id = {}
+        for movie_id, title in zip(movie_ids, titles):
+            self.title_to_id.setdefault(title, movie_id)
+        self.fingerprint = fingerprint
+        self.checked_at = time.time()
+        self.build_trigrams()
+        self.build_prefixes()
+
+    def build_trigrams(self):
+        """Trigram postings: rows of the titles holding trigram g are gram_rows[gram_indptr[g]:gram_indptr[g + 1]]"""
+        self.gram_ids = {}
+        gram_of_row, rows = [], []
+        for row, title in enumerate(self.normalized):
+            for gram in trigrams(title):
+                gram_of_row.append(self.gram_ids.setdefault(gram, len(self.gram_ids)))
+                rows.append(row)
+        gram_of_row = np.array(gram_of_row, dtype=np.int64)
+        order = np.argsort(gram_of_row, kind="stable")  # rows stay ascending within a trigram
+        self.gram_rows = np.array(rows, dtype=np.int32)[order]
+        self.gram_indptr = np.zeros(len(self.gram_ids) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(gram_of_row, minlength=len(self.gram_ids)), out=self.gram_indptr[1:])
+        self.gram_counts = np.bincount(np.array(rows, dtype=np.int64), minlength=len(self)).astype(np.float64)
+
+    def build_prefixes(self):
+        """Sorted prefix keys: every normalized title, plus each word after its first (the title covers that one)"""
+        keys, rows = [], []
+        for row, title in enumerate(self.normalized):
+            keys.append(title)
+            rows.append(row)
+            for word in set(title.split()[1:]):
+                keys.append(word)
+                rows.append(row)
+        order = sorted(range(len(keys)), key=keys.__getitem__)
+        self.prefix_keys = [keys[i] for i in order]
+        self.prefix_rows = np.array(rows, dtype=np.int64)[order]
+
+    def __len__(self):
+        return len(self.movie_ids)
+
+    def substring_matches(self, query):
+        """Positions of titles containing `query`, case-insensitive, in id order"""
+        query = query.lower()
+        return [i for i, title in enumerate(self.normalized) if query in title]
+
+    def fuzzy_candidates(self, query, budget):
+        """
+        Ascending rows of the `budget` titles whose trigrams overlap `query` the most
+
+        Overlap is the share of the shorter string's trigrams found in the
+        other, which tracks WRatio's partial matching of a short query inside a
+        long title and vice versa. Ties at the cut keep the lower rows. None
+        means "scan every title": budget 0, or a query without any indexed trigram.
+        """
+        query_grams = trigrams(query)
+        gram_ids = [self.gram_ids[gram] for gram in query_grams if gram in self.gram_ids]
+        if not budget or not gram_ids:
+            return None
+        postings = np.concatenate([self.gram_rows[self.gram_indptr[g]:self.gram_indptr[g + 1]] for g in gram_ids])
+        shared = np.bincount(postings, minlength=len(self))
+        rows = np.flatnonzero(shared)
+        if len(rows) > budget:
+            overlap = shared[rows] / np.minimum(self.gram_counts[rows], len(query_grams))
+            rows = np.sort(rows[np.argsort(-overlap, kind="stable")[:budget]])
+        return rows
+
+    def fuzzy_matches(self, query, limit, budget=TITLE_TRIGRAM_BUDGET, workers=TITLE_FUZZY_WORKERS):
+        """
+        [(row, WRatio score)] of the best `limit` fuzzy matches scoring above FUZZY_MIN_SCORE
+
+        One batch cdist call over the already lower-cased titles, split across
+        `workers` threads; score_cutoff lets WRatio give up early on titles
+        that cannot reach the cut-off. Ties keep row order, as process.extract does.
+        """
+        rows = self.fuzzy_candidates(query, budget)
+        choices = self.normalized if rows is None else [self.normalized[row] for row in rows]
+        if not choices:
+            return []
+        scores = process.cdist(
+            [query], choices, scorer=fuzz.WRatio, score_cutoff=FUZZY_MIN_SCORE,
+            dtype=np.float64, workers=workers,
+        )[0]
+        positions = np.flatnonzero(scores > FUZZY_MIN_SCORE)
+        positions = positions[np.argsort(-scores[positions], kind="stable")[:limit]]
+        if rows is not None:
+            return list(zip(rows[positions].tolist(), scores[positions].tolist()))
+        return list(zip(positions.tolist(), scores[positions].tolist()))
+
+    def suggest(self, query, limit):
+        """Rows of up to `limit` titles with a title or word starting with `query`, most voted first"""
+        prefix = " ".join(query.lower().split())
+        if not prefix or limit <= 0:
+            return []
+        lo = bisect_left(self.prefix_keys, prefix)
+        hi = bisect_left(self.prefix_keys, prefix + "\U0010ffff", lo)
+        rows = self.prefix_rows[lo:hi]
+        pool = limit * SUGGEST_RANK_POOL
+        if len(rows) > pool:
+            # A title can sit under several keys of the range, so keep a margin before de-duplicating
+            rows = rows[np.argpartition(-self.votes[rows], pool)[:pool]]
+        suggestions = []
+        for row in rows[np.lexsort((rows, -self.votes[rows]))].tolist():
+            if row not in suggestions:
+                suggestions.append(row)
+                if len(suggestions) == limit:
+                    break
+        return suggestions
+
+
+def title_rows(db, *columns):
+    return db.query(Movie.id, *columns).filter(Movie.title.isnot(None)).order_by(Movie.id).all()
+
+
+def build_title_index(db, fingerprint=None):
+    fingerprint = fingerprint or movie_table_fingerprint(db)
+    votes_fingerprint = movie_votes_fingerprint(db)
+    rows = title_rows(db, Movie.title, Movie.vote_count)
+    index = TitleIndex([r.id for r in rows], [r.title for r in rows], fingerprint, [r.vote_count or 0 for r in rows])
+    index.votes_fingerprint = votes_fingerprint
+    return index
+
+
+def refresh_votes(index, db, votes_fingerprint):
+    """Re-read the vote counts suggestions are ranked by; titles and ids are unchanged"""
+    rows = title_rows(db, Movie.vote_count)
+    index.votes = np.array([r.vote_count or 0 for r in rows], dtype=np.int64)
+    index.votes_fingerprint = votes_fingerprint
+
+
+def get_title_index():
+    """Return the title index, rebuilding it if the movies table changed since the last check"""
+    global _index
+    with _index_lock:
+        if _index is not None and time.time() - _index.checked_at < TITLE_INDEX_REFRESH_SECONDS:
+            return _index
+        with get_db() as db:
+            fingerprint = movie_table_fingerprint(db)
+            if _index is not None and _index.fingerprint == fingerprint:
+                votes_fingerprint = movie_votes_fingerprint(db)
+                if _index.votes_fingerprint != votes_fingerprint:
+                    refresh_votes(_index, db, votes_fingerprint)
+                _index.checked_at = time.time()
+            else:
+                start = time.time()
+                _index = build_title_index(db, fingerprint)
+                print(f"🔤 Title index built: {len(_index)} titles in {time.time() - start:.2f}s")
+        return _index
+
+
+def load_title_index():
+    """Startup warm-up loader"""
+    index = get_title_index()
+    return f"{len(index)} titles, {len(index.gram_ids)} trigrams"
+
+
+def recall_check(num_queries=200, budgets=(250, 500, 1000, 2000, 5000), limit=100, strong=80, seed=0):
+    """
+    Fuzzy matches lost by the trigram prefilter at each budget, against scoring every title
+
+    Queries are sampled titles, title words and titles with one typo. A match
+    is lost when the prefiltered list ranks a lower score in its place; "strong"
+    counts only the losses scoring at least `strong`. Titles replaced by
+    others with the same score are not losses.
+    """
+    index = get_title_index()
+    rng = np.random.default_rng(seed)
+    queries = []
+    for row in rng.choice(len(index), min(num_queries, len(index)), replace=False):
+        title = index.normalized[row]
+        kind = len(queries) % 3
+        if kind == 1 and title.split():
+            title = str(rng.choice(title.split()))
+        elif kind == 2 and len(title) > 3:
+            cut = int(rng.integers(len(title)))
+            title = title[:cut] + title[cut + 1:]
+        queries.append(title)
+
+    start = time.time()
+    expected = [index.fuzzy_matches(q, limit, budget=0) for q in queries]
+    full_ms = (time.time() - start) * 1000 / len(queries)
+    total = sum(len(e) for e in expected)
+    total_strong = sum(1 for e in expected for _, score in e if score >= strong)
+    print(f"[INFO] {len(index)} titles, {len(queries)} queries, {total} fuzzy matches "
+          f"({total_strong} scoring >= {strong}), full scan {full_ms:.2f} ms/query")
+
+    for budget in budgets:
+        start = time.time()
+        found = [index.fuzzy_matches(q, limit, budget=budget) for q in queries]
+        elapsed_ms = (time.time() - start) * 1000 / len(queries)
+        lost = lost_strong = affected = 0
+        for e, f in zip(expected, found):
+            # Position k loses a match when the k-th best score dropped (or is missing)
+            dropped = [score for k, (_, score) in enumerate(e) if k >= len(f) or f[k][1] < score]
+            lost += len(dropped)
+            lost_strong += sum(1 for score in dropped if score >= strong)
+            affected += bool(dropped)
+        print(f"[INFO] budget {budget}: {elapsed_ms:.2f} ms/query, {lost} of {total} matches lost "
+              f"({lost / max(total, 1):.2%}) in {affected} queries, strong {lost_strong} of {total_strong} "
+              f"({lost_strong / max(total_strong, 1):.2%})")
+
+
+def benchmark(num_queries=100, limit=100, seed=0):
+    """Fuzzy-matching throughput at 1, 4 and all cores, full scan and prefiltered, checked against process.extract"""
+    index = get_title_index()
+    rng = np.random.default_rng(seed)
+    queries = [index.normalized[row] for row in rng.choice(len(index), min(num_queries, len(index)), replace=False)]
+
+    start = time.time()
+    reference = []
+    for query in queries:
+        matches = process.extract(query, index.normalized, scorer=fuzz.WRatio, limit=limit)
+        reference.append([(i, score) for _, score, i in matches if score > FUZZY_MIN_SCORE])
+    elapsed = time.time() - start
+    print(f"[INFO] {len(index)} titles, {len(queries)} queries, {os.cpu_count()} cores; "
+          f"process.extract full scan: {len(queries) / elapsed:.1f} queries/s")
+
+    for workers in sorted({1, 4, os.cpu_count() or 1}):
+        for budget in (0, TITLE_TRIGRAM_BUDGET or 5000):
+            start = time.time()
+            found = [index.fuzzy_matches(q, limit, budget=budget, workers=workers) for q in queries]
+            elapsed = time.time() - start
+            line = f"[INFO] workers={workers} budget={budget or 'all'}: {len(queries) / elapsed:.1f} queries/s"
+            if not budget:
+                same = sum(f == r for f, r in zip(found, reference))
+                line += f", {same}/{len(queries)} identical to process.extract"
+            print(line)
+
+
+def suggest_benchmark(num_queries=2000, limit=8, seed=0):
+    """Suggestion latency for prefixes typed one character at a time: p50 / p99 / max"""
+    index = get_title_index()
+    rng = np.random.default_rng(seed)
+    prefixes = []
+    while len(prefixes) < num_queries:
+        title = index.normalized[int(rng.integers(len(index)))]
+        words = title.split()
+        word = " ".join(words[int(rng.integers(len(words))):]) if words else title
+        prefixes.extend(word[:n] for n in range(1, min(len(word), 12) + 1))
+    timings = []
+    for prefix in prefixes[:num_queries]:
+        start = time.perf_counter()
+        index.suggest(prefix, limit)
+        timings.append((time.perf_counter() - start) * 1000)
+    p50, p99 = np.percentile(timings, [50, 99])
+    print(f"[INFO] {len(index)} titles, {len(index.prefix_keys)} prefix keys, {len(timings)} prefixes: "
+          f"p50 {p50:.3f} ms, p99 {p99:.3f} ms, max {max(timings):.3f} ms")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "recall":
+        num_queries = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+        budgets = [int(b) for b in sys.argv[3:]] or (250, 500, 1000, 2000, 5000)
+        recall_check(num_queries, budgets)
+    elif len(sys.argv) > 1 and sys.argv[1] == "bench":
+        benchmark(int(sys.argv[2]) if len(sys.argv) > 2 else 100)
+    elif len(sys.argv) > 1 and sys.argv[1] == "suggest-bench":
+        suggest_benchmark(int(sys.argv[2]) if len(sys.argv) > 2 else 2000)
+    else:
+        print("Usage: python title_index.py recall [num_queries] [budget ...] | bench [num_queries] | suggest-bench [num_queries]")
@@ -1,50 +1,86 @@
-import json
+import heapq
+import os
+import numpy as np
 from models import Movie
 from database import get_db
+import token_store
+
+# "count": rank by number of shared title words; "idf": weight each shared word by its rarity
+TITLE_OVERLAP_WEIGHTING = os.getenv("TITLE_OVERLAP_WEIGHTING", "count")
 
 def get_movie_by_id(movie_id, db):
         return db.query(Movie).filter(Movie.id == movie_id).first()
 
 
-def get_all_movies_except(exclude_id, db):
-        return db.query(Movie).filter(
-            Movie.id != exclude_id,
-            Movie.titlewords.isnot(None),
-            Movie.titlewords != '[]',
-            Movie.titlewords != ''
-        ).all()
+class TitleIndex:
+    """Title word -> movie rows postings over a token store, with per-word IDF"""
 
+    def __init__(self, store):
+        self.store = store
+        postings = store.title_matrix().tocsc()
+        self.offsets = postings.indptr
+        self.rows = postings.indices
+        document_frequency = np.diff(self.offsets)
+        self.idf = np.log(max(len(store), 1) / np.maximum(document_frequency, 1))
 
-def recommend_movies_by_titles(base_movie, candidate_movies, limit: int = 5):
-    try:
-        base_titlewords = set(json.loads(base_movie.titlewords))
-        if not base_titlewords:
-            print("The movie has no titlewords.")
+    def postings(self, token_id):
+        return self.rows[self.offsets[token_id]:self.offsets[token_id + 1]]
+
+    def top_k(self, token_ids, limit, weighting="count", exclude_row=None):
+        """
+        Best `limit` (row, score) pairs by shared title words, best first
+
+        Only the postings of the seed's words are read. "count" scores a movie
+        by how many words it shares; "idf" sums the shared words' IDF so rare
+        words outweigh common ones. Ties keep movie-id order.
+        """
+        token_ids = [t for t in np.unique(token_ids).tolist() if t < len(self.offsets) - 1]
+        if not token_ids:
             return []
-    except Exception as e:
-        print(f"Failed to fetch titlewords for the movie: {e}")
+        rows = np.concatenate([self.postings(t) for t in token_ids])
+        if weighting == "idf":
+            weights = np.concatenate([np.full(len(self.postings(t)), self.idf[t]) for t in token_ids])
+        else:
+            weights = np.ones(len(rows))
+        rows, inverse = np.unique(rows, return_inverse=True)
+        scores = np.bincount(inverse, weights=weights)
+        return heapq.nlargest(
+            limit,
+            ((row, score) for row, score in zip(rows.tolist(), scores.tolist()) if row != exclude_row),
+            key=lambda pair: (pair[1], -pair[0]),
+        )
+
+
+# Postings index over the current token store, rebuilt when the store is re-synced
+_index = None
+
+
+def get_title_index(store):
+    global _index
+    if _index is None or _index.store is not store:
+        _index = TitleIndex(store)
+    return _index
+
+
+def recommend_movies_by_titles(base_movie, store, limit: int = 5, weighting=None):
+    """Rank stored movies by the title words they share with base_movie"""
+    base_ids = np.unique(store.movie_title_ids(base_movie.id, base_movie.titlewords))
+    if not len(base_ids):
+        print("The movie has no titlewords.")
         return []
 
-    recommendations = []
-    for movie in candidate_movies:
-        try:
-            other_titlewords = set(json.loads(movie.titlewords))
-            if not other_titlewords:
-                continue
-        except Exception:
-            continue
-
-        overlap = base_titlewords & other_titlewords
-        if overlap:
-            recommendations.append((len(overlap), movie, overlap))
-
-    if not recommendations:
+    weighting = weighting or TITLE_OVERLAP_WEIGHTING
+    top = get_title_index(store).top_k(base_ids, limit, weighting, exclude_row=store.row_of(base_movie.id))
+    if not top:
         print("No recommendations based on titleword overlap.")
+        return []
 
-    return sorted(recommendations, key=lambda x: x[0], reverse=True)[:limit]
-
-
-
+    base_words = set(base_ids.tolist())
+    recommendations = []
+    for row, score in top:
+        overlap = set(store.words([t for t in store.title_ids(row).tolist() if t in base_words]))
+        recommendations.append((len(overlap), int(store.movie_ids[row]), overlap))
+    return recommendations
 
 
 def recommend(movie_id: int, limit: int, db):
@@ -56,17 +92,17 @@ def recommend(movie_id: int, limit: int, db):
 
         print(f"\n Selected Movie: {base_movie.title}\n")
 
-        candidates = get_all_movies_except(movie_id, db)
-        if not candidates:
-            print("No candidate movies found in the database.")
-            return
+        recommendations = recommend_movies_by_titles(base_movie, token_store.get_store(db), limit)
 
-        recommendations = recommend_movies_by_titles(base_movie, candidates, limit)
-    
         if not recommendations:
             print("No recommendations found.")
             return []
 
+        id_to_movie = {movie.id: movie for movie in
+                       db.query(Movie).filter(Movie.id.in_([rec[1] for rec in recommendations])).all()}
+        recommendations = [(count, id_to_movie[rid], overlap) for count, rid, overlap in recommendations
+                           if rid in id_to_movie]
+
         for count, movie, overlap in recommendations:
             print(f"{movie.title} ----> Common titlewords ({count}): {', '.join(overlap)}")
 
@@ -0,0 +1,331 @@
+#!/usr/bin/env python3
+"""
+Token store: every movie's overview tokens and title words as integer ids over one shared vocabulary
+
+Overviews are tokenized with simple_preprocess (token order and repeats kept,
+so TF-IDF can count them) and titlewords are decoded from their JSON list once,
+instead of by every recommender on every request. The store is saved under
+TOKEN_STORE_DIR and kept current by sync_store: rows whose overview and
+titlewords checksum is unchanged are reused, only changed or new movies are
+re-tokenized, and token ids only ever get appended, so ids stay stable for
+artifacts built from an older store. A running process re-syncs when
+movie_table_fingerprint changes, checked at most every
+TOKEN_STORE_REFRESH_SECONDS.
+
+    python token_store.py [sync]   # create or update the store
+    python token_store.py info
+"""
+
+import json
+import os
+import threading
+import time
+import zlib
+import numpy as np
+from scipy import sparse
+from gensim.utils import simple_preprocess
+from database import get_db, movie_table_fingerprint
+from models import Movie
+
+TOKEN_STORE_DIR = os.getenv("TOKEN_STORE_DIR", "token_store")
+TOKEN_STORE_REFRESH_SECONDS = float(os.getenv("TOKEN_STORE_REFRESH_SECONDS", "30"))
+VOCABULARY_FILE = "vocabulary.json"
+TOKENS_FILE = "tokens.npz"
+
+# Loaded store, shared by every recommender in this process
+_store = None
+_store_lock = threading.Lock()
+
+
+def tokenize_overview(overview):
+    return simple_preprocess(overview, deacc=True) if overview else []
+
+
+def decode_titlewords(titlewords):
+    """Words of the titlewords JSON list; [] if empty or malformed"""
+    try:
+        words = json.loads(titlewords) if titlewords else []
+    except (ValueError, TypeError):
+        return []
+    return [str(word) for word in words] if isinstance(words, list) else []
+
+
+def row_checksum(overview, titlewords):
+    return zlib.crc32(f"{overview or ''}\x00{titlewords or ''}".encode("utf-8"))
+
+
+class Vocabulary:
+    """Token <-> id, append-only"""
+
+    def __init__(self, tokens=()):
+        self.tokens = list(tokens)
+        self.ids = {token: i for i, token in enumerate(self.tokens)}
+
+    def __len__(self):
+        return len(self.tokens)
+
+    def add(self, tokens):
+        """Ids of tokens, assigning new ids to unseen ones"""
+        ids = []
+        for token in tokens:
+            token_id = self.ids.get(token)
+            if token_id is None:
+                token_id = self.ids[token] = len(self.tokens)
+                self.tokens.append(token)
+            ids.append(token_id)
+        return ids
+
+    def lookup(self, tokens):
+        """Ids of the known tokens; unknown tokens cannot match any stored row"""
+        return [self.ids[token] for token in tokens if token in self.ids]
+
+    def checksum(self, size):
+        """crc of the first `size` tokens, to check that saved artifacts use the same ids"""
+        return zlib.crc32("\n".join(self.tokens[:size]).encode("utf-8"))
+
+
+class TokenStore:
+    """Row-aligned movie ids with CSR-style token id arrays for overviews and titles"""
+
+    def __init__(self, vocabulary, movie_ids, checksums, overview_indptr, overview_tokens,
+                 title_indptr, title_tokens, fingerprint=None):
+        self.vocabulary = vocabulary
+        self.movie_ids = movie_ids  # sorted int64, row i holds movie_ids[i]
+        self.checksums = checksums  # uint32 crc of overview + titlewords per row
+        self.overview_indptr = overview_indptr
+        self.overview_tokens = overview_tokens  # int32 token ids in text order
+        self.title_indptr = title_indptr
+        self.title_tokens = title_tokens
+        self.fingerprint = fingerprint  # movie_table_fingerprint the store was synced at
+        self.checked_at = time.time()  # when get_store last compared it with the movies table
+        self._matrices = {}  # full-catalog matrices, built on first use
+
+    def __len__(self):
+        return len(self.movie_ids)
+
+    @property
+    def nbytes(self):
+        return sum(a.nbytes for a in (self.movie_ids, self.checksums, self.overview_indptr,
+                                      self.overview_tokens, self.title_indptr, self.title_tokens))
+
+    def row_of(self, movie_id):
+        row = int(np.searchsorted(self.movie_ids, movie_id))
+        if row < len(self.movie_ids) and self.movie_ids[row] == movie_id:
+            return row
+        return None
+
+    def overview_ids(self, row):
+        return self.overview_tokens[self.overview_indptr[row]:self.overview_indptr[row + 1]]
+
+    def title_ids(self, row):
+        return self.title_tokens[self.title_indptr[row]:self.title_indptr[row + 1]]
+
+    def movie_overview_ids(self, movie_id, overview=None):
+        """Overview token ids of a movie, tokenizing `overview` if the movie is not stored yet"""
+        row = self.row_of(movie_id)
+        if row is not None:
+            return self.overview_ids(row)
+        return np.array(self.vocabulary.lookup(tokenize_overview(overview)), dtype=np.int32)
+
+    def movie_title_ids(self, movie_id, titlewords=None):
+        """Title word ids of a movie, decoding `titlewords` if the movie is not stored yet"""
+        row = self.row_of(movie_id)
+        if row is not None:
+            return self.title_ids(row)
+        return np.array(self.vocabulary.lookup(decode_titlewords(titlewords)), dtype=np.int32)
+
+    def words(self, token_ids):
+        return [self.vocabulary.tokens[i] for i in token_ids]
+
+    def _matrix(self, indptr, tokens, movie_ids, binary):
+        if movie_ids is None:
+            rows = np.arange(len(self.movie_ids))
+            present = np.ones(len(rows), dtype=bool)
+        else:
+            movie_ids = np.asarray(movie_ids, dtype=np.int64)
+            rows = np.minimum(np.searchsorted(self.movie_ids, movie_ids), max(len(self.movie_ids) - 1, 0))
+            present = (self.movie_ids[rows] == movie_ids) if len(self.movie_ids) else np.zeros(len(rows), bool)
+        starts, ends = indptr[rows], indptr[rows + 1]
+        lengths = np.where(present, ends - starts, 0)
+        out_indptr = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64)
+        if len(rows) and lengths.sum():
+            # Gather every selected row's slice in one vectorized take
+            offsets = np.repeat(starts - out_indptr[:-1], lengths) + np.arange(out_indptr[-1])
+            indices = tokens[offsets]
+        else:
+            indices = np.empty(0, dtype=np.int32)
+        matrix = sparse.csr_matrix(
+            (np.ones(len(indices), dtype=np.float32), indices, out_indptr),
+            shape=(len(rows), max(len(self.vocabulary), 1)),
+        )
+        matrix.sum_duplicates()  # repeated tokens become counts
+        if binary:
+            matrix.data[:] = 1.0
+        return matrix
+
+    def overview_matrix(self, movie_ids=None, binary=False):
+        """Movies x vocabulary CSR of overview token counts (or 0/1), rows aligned to movie_ids"""
+        if movie_ids is None:
+            key = ("overview", binary)
+            if key not in self._matrices:
+                self._matrices[key] = self._matrix(self.overview_indptr, self.overview_tokens, None, binary)
+            return self._matrices[key]
+        return self._matrix(self.overview_indptr, self.overview_tokens, movie_ids, binary)
+
+    def title_matrix(self, movie_ids=None):
+        """Movies x vocabulary binary CSR of title words, rows aligned to movie_ids (cached for all rows)"""
+        if movie_ids is None:
+            if "title" not in self._matrices:
+                self._matrices["title"] = self._matrix(self.title_indptr, self.title_tokens, None, True)
+            return self._matrices["title"]
+        return self._matrix(self.title_indptr, self.title_tokens, movie_ids, binary=True)
+
+
+def empty_store():
+    empty_ptr = np.zeros(1, dtype=np.int64)
+    empty_tokens = np.empty(0, dtype=np.int32)
+    return TokenStore(Vocabulary(), np.empty(0, dtype=np.int64), np.empty(0, dtype=np.uint32),
+                      empty_ptr, empty_tokens, empty_ptr, empty_tokens)
+
+
+def sync_store(db, store=None, batch_size=2000):
+    """
+    Return a store matching the movies table, re-tokenizing only changed or new rows
+
+    Reuses `store` (or an empty one) for every movie whose checksum is unchanged;
+    rows of deleted movies are dropped.
+    """
+    start = time.time()
+    store = store or empty_store()
+    vocabulary = Vocabulary(store.vocabulary.tokens)
+    fingerprint = movie_table_fingerprint(db)
+
+    movie_ids, checksums = [], []
+    overview_parts, title_parts = [], []
+    retokenized = kept = 0
+    rows = db.query(Movie.id, Movie.overview, Movie.titlewords)\
+        .order_by(Movie.id)\
+        .yield_per(batch_size)
+    for movie_id, overview, titlewords in rows:
+        checksum = row_checksum(overview, titlewords)
+        old_row = store.row_of(movie_id)
+        kept += old_row is not None
+        if old_row is not None and store.checksums[old_row] == checksum:
+            overview_parts.append(store.overview_ids(old_row))
+            title_parts.append(store.title_ids(old_row))
+        else:
+            overview_parts.append(np.array(vocabulary.add(tokenize_overview(overview)), dtype=np.int32))
+            title_parts.append(np.array(vocabulary.add(decode_titlewords(titlewords)), dtype=np.int32))
+            retokenized += 1
+        movie_ids.append(movie_id)
+        checksums.append(checksum)
+
+    def pack(parts):
+        indptr = np.zeros(len(parts) + 1, dtype=np.int64)
+        np.cumsum([len(p) for p in parts], out=indptr[1:])
+        tokens = np.concatenate(parts).astype(np.int32) if parts else np.empty(0, dtype=np.int32)
+        return indptr, tokens
+
+    overview_indptr, overview_tokens = pack(overview_parts)
+    title_indptr, title_tokens = pack(title_parts)
+    synced = TokenStore(
+        vocabulary, np.array(movie_ids, dtype=np.int64), np.array(checksums, dtype=np.uint32),
+        overview_indptr, overview_tokens, title_indptr, title_tokens, fingerprint,
+    )
+    print(f"🔤 Token store synced in {time.time() - start:.1f}s: {len(synced)} movies, "
+          f"{retokenized} tokenized, {len(synced) - retokenized} reused, {len(store) - kept} removed, "
+          f"{len(vocabulary)} tokens")
+    return synced
+
+
+def save_store(store, directory=TOKEN_STORE_DIR):
+    """Write the store atomically; the vocabulary goes first since it is append-only"""
+    os.makedirs(directory, exist_ok=True)
+    vocabulary_path = os.path.join(directory, VOCABULARY_FILE)
+    with open(vocabulary_path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(store.vocabulary.tokens, f, ensure_ascii=False)
+    os.replace(vocabulary_path + ".tmp", vocabulary_path)
+
+    tokens_path = os.path.join(directory, TOKENS_FILE)
+    with open(tokens_path + ".tmp", "wb") as f:
+        np.savez(
+            f,
+            movie_ids=store.movie_ids, checksums=store.checksums,
+            overview_indptr=store.overview_indptr, overview_tokens=store.overview_tokens,
+            title_indptr=store.title_indptr, title_tokens=store.title_tokens,
+            fingerprint=np.array(store.fingerprint or ""),
+        )
+    os.replace(tokens_path + ".tmp", tokens_path)
+
+
+def load_store(directory=TOKEN_STORE_DIR):
+    """Load a saved store, or None if there is none"""
+    vocabulary_path = os.path.join(directory, VOCABULARY_FILE)
+    tokens_path = os.path.join(directory, TOKENS_FILE)
+    if not (os.path.exists(vocabulary_path) and os.path.exists(tokens_path)):
+        return None
+    try:
+        with open(vocabulary_path, encoding="utf-8") as f:
+            vocabulary = Vocabulary(json.load(f))
+        with np.load(tokens_path) as data:
+            store = TokenStore(
+                vocabulary, data["movie_ids"], data["checksums"],
+                data["overview_indptr"], data["overview_tokens"],
+                data["title_indptr"], data["title_tokens"],
+                str(data["fingerprint"]) or None,
+            )
+    except Exception as e:
+        print(f"⚠️ Could not load token store from {directory}/: {e}")
+        return None
+    if len(store.overview_tokens) and int(store.overview_tokens.max()) >= len(vocabulary):
+        print(f"⚠️ Token store in {directory}/ refers to tokens missing from its vocabulary")
+        return None
+    return store
+
+
+def get_store(db, fingerprint=None):
+    """
+    Return the process-wide token store
+
+    Loads it from disk on first use. The store is synced and saved first when
+    it no longer matches the movies table: against `fingerprint` (a
+    movie_table_fingerprint) when given, else against the table itself, checked
+    at most every TOKEN_STORE_REFRESH_SECONDS.
+    """
+    global _store
+    with _store_lock:
+        if (_store is not None and fingerprint is None
+                and time.time() - _store.checked_at < TOKEN_STORE_REFRESH_SECONDS):
+            return _store
+        fingerprint = fingerprint or movie_table_fingerprint(db)
+        store = _store or load_store()
+        if store is None or store.fingerprint != fingerprint:
+            store = sync_store(db, store)
+            save_store(store)
+        store.checked_at = time.time()
+        _store = store
+        return _store
+
+
+def print_info(directory=TOKEN_STORE_DIR):
+    store = load_store(directory)
+    if store is None:
+        print(f"No token store in {directory}/")
+        return
+    print(f"📦 {directory}/: {len(store)} movies, {len(store.vocabulary)} tokens, "
+          f"{len(store.overview_tokens)} overview and {len(store.title_tokens)} title tokens stored, "
+          f"{store.nbytes / 1e6:.1f} MB, fingerprint {store.fingerprint}")
+
+
+if __name__ == "__main__":
+    import sys
+
+    command = sys.argv[1] if len(sys.argv) > 1 else "sync"
+    if command == "info":
+        print_info()
+    elif command == "sync":
+        with get_db() as db:
+            save_store(sync_store(db, load_store()))
+        print_info()
+    else:
+        print("Usage: python token_store.py [sync|info]")